@@ -2,18 +2,33 @@
 FastAPI backend for lesson generation with SVG primitives.
 """
 import os
-import json
+import re
+import asyncio
+import gzip
 import hashlib
-import uuid
+import sqlite3
+import threading
+import secrets
 import datetime
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
+import aiofiles
+import msgspec
+import orjson
+from jinja2 import Environment, FileSystemLoader
+from markupsafe import Markup, escape
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import Response, HTMLResponse, FileResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from starlette.requests import Request as StarletteRequest
-from pydantic import BaseModel
 
 try:
     from dotenv import load_dotenv
@@ -21,11 +36,44 @@ try:
 except ImportError:
     pass
 
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:
+    rcssmin = rjsmin = None  # type: ignore
+    print("Warning: rcssmin/rjsmin not installed. The lesson runtime will be served unminified. Install with: pip install rcssmin rjsmin")
+
 from gemini_client import GeminiClient
-from starvector_client import StarVectorClient
+from starvector_client import get_starvector_client
 from fallbacks import ParametricSVGGenerator
 
-app = FastAPI(title="Kydy Lesson Generator")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the batched primitives writer for the lifetime of the app."""
+    flush_task = asyncio.create_task(_primitive_flush_loop())
+    try:
+        yield
+    finally:
+        flush_task.cancel()
+        await asyncio.to_thread(_flush_primitive_rows)
+        await gemini_client.aclose()
+        starvector_client.close()
+        await starvector_client.aclose()
+
+
+app = FastAPI(title="Kydy Lesson Generator", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files referenced with a ?v= content version, so clients may cache them forever."""
+    
+    def file_response(self, *args: Any, **kwargs: Any) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,39 +82,111 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 ASSETS_DIR = BASE_DIR / "assets"
+TEMPLATES_DIR = BASE_DIR / "templates"
+STATIC_DIR = BASE_DIR / "static"
 DATA_DIR.mkdir(exist_ok=True)
 ASSETS_DIR.mkdir(exist_ok=True)
 
+class CompactTemplateLoader(FileSystemLoader):
+    """Drops line indentation from template source, so it's stripped once at compile time."""
+    
+    _INDENT_RE = re.compile(r"^[ \t]+", re.MULTILINE)
+    
+    def get_source(self, environment: Environment, template: str) -> tuple:
+        source, filename, uptodate = super().get_source(environment, template)
+        return self._INDENT_RE.sub("", source), filename, uptodate
+
+
+template_env = Environment(
+    loader=CompactTemplateLoader(TEMPLATES_DIR),
+    autoescape=True,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+# The lesson runtime (stylesheet + script) is identical for every lesson. Pages served by the API
+# link to it under /static with a content version; standalone pages inline it.
+LESSON_RUNTIME_CSS = (STATIC_DIR / "lesson_runtime.css").read_text(encoding="utf-8")
+LESSON_RUNTIME_JS = (STATIC_DIR / "lesson_runtime.js").read_text(encoding="utf-8")
+if rcssmin is not None:
+    LESSON_RUNTIME_CSS = rcssmin.cssmin(LESSON_RUNTIME_CSS)
+    LESSON_RUNTIME_JS = rjsmin.jsmin(LESSON_RUNTIME_JS)
+template_env.globals.update(
+    runtime_version=hashlib.blake2b(
+        (LESSON_RUNTIME_CSS + LESSON_RUNTIME_JS).encode("utf-8"), digest_size=6
+    ).hexdigest()
+)
+RUNTIME_FILES = {
+    "css": (LESSON_RUNTIME_CSS.encode("utf-8"), "text/css"),
+    "js": (LESSON_RUNTIME_JS.encode("utf-8"), "text/javascript")
+}
+
+
+# Registered ahead of the /static mount so the runtime is served minified from memory.
+@app.get("/static/lesson_runtime.{ext}", include_in_schema=False)
+async def get_lesson_runtime(ext: str):
+    """Serve the lesson runtime stylesheet or script."""
+    if ext not in RUNTIME_FILES:
+        raise HTTPException(status_code=404, detail="Not Found")
+    content, media_type = RUNTIME_FILES[ext]
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
+app.mount("/static", ImmutableStaticFiles(directory=STATIC_DIR), name="static")
+LESSON_TEMPLATE = template_env.get_template("lesson.html.j2")
+LESSON_BODY_TEMPLATE = template_env.get_template("lesson_body.html.j2")
+
 gemini_client = GeminiClient()
-starvector_client = StarVectorClient()
+starvector_client = get_starvector_client()
 fallback_generator = ParametricSVGGenerator()
 
-PRIMITIVES_CACHE_FILE = DATA_DIR / "primitives.json"
-if PRIMITIVES_CACHE_FILE.exists():
-    with open(PRIMITIVES_CACHE_FILE, "r") as f:
-        PRIMITIVES_CACHE = json.load(f)
-else:
-    PRIMITIVES_CACHE = {}
-    with open(PRIMITIVES_CACHE_FILE, "w") as f:
-        json.dump({}, f)
+DB_FILE = DATA_DIR / "kydy.db"
+PRIMITIVES_CACHE_FILE = DATA_DIR / "primitives.json"  # legacy cache, imported into DB_FILE once
+
+db = sqlite3.connect(DB_FILE, isolation_level=None, check_same_thread=False)
+db.execute("PRAGMA journal_mode=WAL")
+db.execute("PRAGMA synchronous=NORMAL")
+db.execute("""
+    CREATE TABLE IF NOT EXISTS primitives (
+        cache_key TEXT PRIMARY KEY,
+        asset_id TEXT,
+        asset_file TEXT,
+        primitive_id TEXT,
+        params BLOB,
+        render_meta BLOB
+    )
+""")
+DB_LOCK = threading.Lock()
+
+# Primitive params/render_meta blobs are MessagePack (DB user_version >= 1).
+msgpack_encoder = msgspec.msgpack.Encoder()
+msgpack_decoder = msgspec.msgpack.Decoder()
+
+# Hot in-memory layer in front of the primitives table.
+PRIMITIVES_CACHE: Dict[str, Dict[str, Any]] = {}
 
 
-class GenerateRequest(BaseModel):
+class GenerateRequest(msgspec.Struct):
     prompt: str
 
 
-class GenerateResponse(BaseModel):
+class GenerateResponse(msgspec.Struct):
     status: str
     lesson_id: str
     render_url: str
     lesson: Dict[str, Any]
 
 
-class SessionData(BaseModel):
+class SessionData(msgspec.Struct, kw_only=True):
+    """A session file on disk; fields are in the order save_session writes them."""
     session_id: str
     topic: str
     lesson_id: Optional[str] = None
@@ -77,7 +197,7 @@ class SessionData(BaseModel):
     updated_at: str
 
 
-class SaveSessionRequest(BaseModel):
+class SaveSessionRequest(msgspec.Struct):
     topic: str
     lesson_id: Optional[str] = None
     messages: List[Dict[str, Any]] = []
@@ -85,6 +205,18 @@ class SaveSessionRequest(BaseModel):
     session_time: int = 0
 
 
+json_encoder = msgspec.json.Encoder()
+
+
+def _decode_body(body: bytes, model: type) -> Any:
+    """Decode and validate a JSON request body, answering 422 on bad input."""
+    try:
+        # strict=False keeps pydantic's lax coercions (e.g. "5" -> 5 for ints).
+        return msgspec.json.decode(body, type=model, strict=False)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API information."""
@@ -119,53 +251,215 @@ async def health():
 
 def compute_cache_key(primitive_id: str, params: Dict[str, Any], model_version: str = "v1") -> str:
     """Compute cache key from primitive_id, params, and model version."""
-    canonical = json.dumps(params, sort_keys=True)
-    raw = f"{primitive_id}:{canonical}:{model_version}"
-    return hashlib.sha256(raw.encode()).hexdigest()
+    canonical = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+    raw = b"%s:%s:%s" % (primitive_id.encode(), canonical, model_version.encode())
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
 
 
-def get_or_generate_primitive(primitive_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Get primitive from cache or generate new one.
-    Returns dict with: asset_id, url, svg (inline), render_meta
-    """
-    cache_key = compute_cache_key(primitive_id, params)
+def _load_cached_primitive(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Look up a primitive cache entry, falling back from memory to the DB."""
+    cached = PRIMITIVES_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    with DB_LOCK:
+        row = db.execute(
+            "SELECT asset_id, asset_file, primitive_id, params, render_meta FROM primitives WHERE cache_key = ?",
+            (cache_key,)
+        ).fetchone()
+    if row is None:
+        return None
+    
+    cached = {
+        "asset_id": row[0],
+        "asset_file": row[1],
+        "primitive_id": row[2],
+        "params": msgpack_decoder.decode(row[3]),
+        "render_meta": msgpack_decoder.decode(row[4])
+    }
+    PRIMITIVES_CACHE[cache_key] = cached
+    return cached
+
+
+# Rows waiting for the next batched write; lookups are served from PRIMITIVES_CACHE meanwhile.
+PENDING_PRIMITIVE_ROWS: Dict[str, tuple] = {}
+PENDING_LOCK = threading.Lock()
+PRIMITIVE_FLUSH_INTERVAL = 0.5
+
+
+def _store_cached_primitive(cache_key: str, entry: Dict[str, Any]) -> None:
+    """Insert a primitive cache entry into memory and queue it for the DB."""
+    PRIMITIVES_CACHE[cache_key] = entry
+    row = (
+        cache_key,
+        entry["asset_id"],
+        entry["asset_file"],
+        entry["primitive_id"],
+        msgpack_encoder.encode(entry["params"]),
+        msgpack_encoder.encode(entry["render_meta"])
+    )
+    with PENDING_LOCK:
+        PENDING_PRIMITIVE_ROWS[cache_key] = row
+
+
+def _flush_primitive_rows() -> None:
+    """Write all queued primitive rows in a single transaction."""
+    with PENDING_LOCK:
+        rows = list(PENDING_PRIMITIVE_ROWS.values())
+        PENDING_PRIMITIVE_ROWS.clear()
+    if not rows:
+        return
+    with DB_LOCK:
+        db.execute("BEGIN")
+        db.executemany("INSERT OR REPLACE INTO primitives VALUES (?, ?, ?, ?, ?, ?)", rows)
+        db.execute("COMMIT")
+
+
+async def _primitive_flush_loop() -> None:
+    """Coalesce cache-miss writes into at most one DB write per interval."""
+    while True:
+        await asyncio.sleep(PRIMITIVE_FLUSH_INTERVAL)
+        if PENDING_PRIMITIVE_ROWS:
+            try:
+                await asyncio.to_thread(_flush_primitive_rows)
+            except Exception as e:
+                print(f"Warning: Failed to write primitives cache: {e}")
+
+
+def _upgrade_primitive_rows() -> None:
+    """Bring existing primitive rows up to the current schema (tracked in PRAGMA user_version)."""
+    with DB_LOCK:
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version >= 2:
+            return
+        db.execute("BEGIN")
+        if version < 1:
+            # v1: params/render_meta blobs move from JSON to MessagePack.
+            rows = db.execute("SELECT cache_key, params, render_meta FROM primitives").fetchall()
+            db.executemany(
+                "UPDATE primitives SET params = ?, render_meta = ? WHERE cache_key = ?",
+                [
+                    (msgpack_encoder.encode(orjson.loads(params)), msgpack_encoder.encode(orjson.loads(render_meta)), cache_key)
+                    for cache_key, params, render_meta in rows
+                ]
+            )
+        # v2: cache keys move from sha256 to blake2b-128; re-key from the stored spec.
+        rows = db.execute("SELECT cache_key, primitive_id, params FROM primitives").fetchall()
+        db.executemany(
+            "UPDATE OR REPLACE primitives SET cache_key = ? WHERE cache_key = ?",
+            [
+                (compute_cache_key(primitive_id, msgpack_decoder.decode(params)), cache_key)
+                for cache_key, primitive_id, params in rows
+            ]
+        )
+        db.execute("PRAGMA user_version = 2")
+        db.execute("COMMIT")
+
+
+def _migrate_legacy_primitives() -> None:
+    """Import primitives.json into the DB the first time the table is created."""
+    if not PRIMITIVES_CACHE_FILE.exists():
+        return
+    with DB_LOCK:
+        if db.execute("SELECT 1 FROM primitives LIMIT 1").fetchone():
+            return
+    
+    with open(PRIMITIVES_CACHE_FILE, "rb") as f:
+        legacy = orjson.loads(f.read())
     
-    if cache_key in PRIMITIVES_CACHE:
-        cached = PRIMITIVES_CACHE[cache_key]
+    for entry in legacy.values():
+        params = entry.get("params", {})
+        # Re-key from the stored spec so entries stay reachable if the key format changes.
+        cache_key = compute_cache_key(entry["primitive_id"], params)
+        _store_cached_primitive(cache_key, {
+            "asset_id": entry["asset_id"],
+            "asset_file": entry["asset_file"],
+            "primitive_id": entry["primitive_id"],
+            "params": params,
+            "render_meta": entry.get("render_meta", {})
+        })
+    _flush_primitive_rows()
+    PRIMITIVES_CACHE.clear()
+
+
+_upgrade_primitive_rows()
+_migrate_legacy_primitives()
+
+
+@lru_cache(maxsize=512)
+def _read_asset(asset_file: str) -> str:
+    """Read an SVG asset. Asset names carry a unique id and are never rewritten, so reads are cached."""
+    # Assets saved before path lengths were recorded get them here, once per process.
+    return starvector_client.annotate_path_lengths((ASSETS_DIR / asset_file).read_text(encoding="utf-8"))
+
+
+def _scan_assets() -> Dict[str, int]:
+    """Map every file in ASSETS_DIR to its size with a single directory scan."""
+    with os.scandir(ASSETS_DIR) as entries:
+        return {entry.name: entry.stat().st_size for entry in entries if entry.is_file()}
+
+
+# Built once at startup and kept current as assets are written.
+ASSET_SIZES: Dict[str, int] = _scan_assets()
+
+
+def _asset_size(asset_file: str) -> Optional[int]:
+    """Size of an asset in bytes, or None if it doesn't exist."""
+    size = ASSET_SIZES.get(asset_file)
+    if size is None:
+        # Picks up files added outside the app since startup.
+        try:
+            size = (ASSETS_DIR / asset_file).stat().st_size
+        except OSError:
+            return None
+        ASSET_SIZES[asset_file] = size
+    return size
+
+
+def _cached_primitive_with_svg(primitive_id: str, cache_key: str) -> Optional[tuple]:
+    """(asset data, SVG markup) for a cached primitive whose asset is still on disk, else None."""
+    cached = _load_cached_primitive(cache_key)
+    if cached is not None:
         asset_file = cached.get("asset_file")
-        if asset_file and (ASSETS_DIR / asset_file).exists():
-            with open(ASSETS_DIR / asset_file, "r") as f:
-                svg_content = f.read()
+        try:
+            svg_content = _read_asset(asset_file) if asset_file else None
+        except OSError:
+            svg_content = None
+        if svg_content is not None:
             return {
                 "asset_id": cached["asset_id"],
                 "primitive_id": primitive_id,
                 "url": f"/assets/{asset_file}",
                 "svg": svg_content if len(svg_content) < 5000 else None,  # Only inline small SVGs
                 "render_meta": cached.get("render_meta", {})
-            }
-    
-    svg_content = None
-    asset_file = None
-    
-    try:
-        prompt = f"Generate an SVG illustration of {primitive_id}"
-        if params:
-            prompt += f" with parameters: {json.dumps(params)}"
-        svg_content = starvector_client.generate_svg(prompt)
-    except Exception as e:
-        print(f"StarVector generation failed: {e}")
-    
+            }, svg_content
+    return None
+
+
+def _primitive_prompt(primitive_id: str, params: Dict[str, Any]) -> str:
+    """StarVector prompt for a primitive."""
+    prompt = f"Generate an SVG illustration of {primitive_id}"
+    if params:
+        prompt += f" with parameters: {orjson.dumps(params).decode()}"
+    return prompt
+
+
+def _store_primitive_svg(primitive_id: str, params: Dict[str, Any], cache_key: str,
+                         svg_content: Optional[str]) -> tuple:
+    """Save a generated SVG (or the parametric fallback) as a new cached asset."""
     if not svg_content or not starvector_client.is_valid_svg(svg_content):
         print(f"Using parametric fallback for {primitive_id}")
         svg_content = fallback_generator.generate(primitive_id, params)
+    svg_content = starvector_client.annotate_path_lengths(svg_content)
     
-    asset_id = str(uuid.uuid4())[:8]
+    asset_id = secrets.token_hex(4)
     asset_file = f"{primitive_id}_{asset_id}.svg"
     asset_path = ASSETS_DIR / asset_file
     
-    with open(asset_path, "w") as f:
-        f.write(svg_content)
+    svg_bytes = svg_content.encode("utf-8")
+    with open(asset_path, "wb") as f:
+        f.write(svg_bytes)
+    ASSET_SIZES[asset_file] = len(svg_bytes)
     
     width, height = starvector_client.extract_dimensions(svg_content)
     render_meta = {
@@ -174,16 +468,13 @@ def get_or_generate_primitive(primitive_id: str, params: Dict[str, Any]) -> Dict
         "height": height
     }
     
-    PRIMITIVES_CACHE[cache_key] = {
+    _store_cached_primitive(cache_key, {
         "asset_id": asset_id,
         "asset_file": asset_file,
         "primitive_id": primitive_id,
         "params": params,
         "render_meta": render_meta
-    }
-    
-    with open(PRIMITIVES_CACHE_FILE, "w") as f:
-        json.dump(PRIMITIVES_CACHE, f, indent=2)
+    })
     
     return {
         "asset_id": asset_id,
@@ -191,133 +482,219 @@ def get_or_generate_primitive(primitive_id: str, params: Dict[str, Any]) -> Dict
         "url": f"/assets/{asset_file}",
         "svg": svg_content if len(svg_content) < 5000 else None,
         "render_meta": render_meta
-    }
+    }, svg_content
+
+
+def _primitive_with_svg(primitive_id: str, params: Dict[str, Any]) -> tuple:
+    """get_or_generate_primitive, also returning the full SVG markup it read or generated."""
+    cache_key = compute_cache_key(primitive_id, params)
+    cached = _cached_primitive_with_svg(primitive_id, cache_key)
+    if cached is not None:
+        return cached
+    
+    svg_content = None
+    try:
+        svg_content = starvector_client.generate_svg(_primitive_prompt(primitive_id, params))
+    except Exception as e:
+        print(f"StarVector generation failed: {e}")
+    return _store_primitive_svg(primitive_id, params, cache_key, svg_content)
+
+
+# Validating, annotating and saving generated SVGs is CPU work (lxml releases the GIL while parsing).
+_SVG_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="svg")
+
+
+async def _generate_primitive_with_svg(primitive_id: str, params: Dict[str, Any], cache_key: str) -> tuple:
+    """_primitive_with_svg for a cache miss: StarVector over the async client, post-processing on _SVG_EXEC."""
+    svg_content = None
+    try:
+        svg_content = await starvector_client.generate_svg_async(_primitive_prompt(primitive_id, params))
+    except Exception as e:
+        print(f"StarVector generation failed: {e}")
+    return await asyncio.get_running_loop().run_in_executor(
+        _SVG_EXEC, _store_primitive_svg, primitive_id, params, cache_key, svg_content
+    )
+
+
+async def _primitives_with_svg(specs: List[tuple]) -> List[tuple]:
+    """_primitive_with_svg for several (primitive_id, params) specs. The cache misses' StarVector
+    calls run concurrently, and each SVG is post-processed as soon as it arrives, overlapping
+    the calls still in flight."""
+    cache_keys = [compute_cache_key(primitive_id, params) for primitive_id, params in specs]
+    results = await asyncio.gather(*[
+        asyncio.to_thread(_cached_primitive_with_svg, primitive_id, cache_key)
+        for (primitive_id, _), cache_key in zip(specs, cache_keys)
+    ])
+    misses = [i for i, result in enumerate(results) if result is None]
+    stored = await asyncio.gather(*[
+        _generate_primitive_with_svg(*specs[i], cache_keys[i]) for i in misses
+    ])
+    for i, result in zip(misses, stored):
+        results[i] = result
+    return results
+
+
+def get_or_generate_primitive(primitive_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get primitive from cache or generate new one.
+    Returns dict with: asset_id, url, svg (inline), render_meta
+    """
+    return _primitive_with_svg(primitive_id, params)[0]
+
+
+# Topic keywords, matched as case-insensitive substrings like the original `in` checks.
+OHM_KEYWORDS_RE = re.compile(r"ohm|resistor", re.IGNORECASE)
+CIRCUIT_KEYWORDS_RE = re.compile(r"ohm|resistor|circuit", re.IGNORECASE)
+MEDICAL_KEYWORDS_RE = re.compile(r"medical|stethoscope", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def _fallback_structure(topic: str, is_ohm: bool) -> bytes:
+    """
+    Build the canned fallback lesson structure.
+    Cached as serialized bytes so every caller gets a fresh, mutable copy.
+    """
+    if is_ohm:
+        steps = [
+            {
+                "title": "Introduction to Ohm's Law",
+                "description": "Ohm's Law is a fundamental principle in electrical engineering that describes the relationship between voltage, current, and resistance in an electrical circuit. It states that the current through a conductor between two points is directly proportional to the voltage across the two points and inversely proportional to the resistance between them.",
+                "key_points": [
+                    "Ohm's Law: V = I × R",
+                    "Voltage (V) is measured in volts",
+                    "Current (I) is measured in amperes",
+                    "Resistance (R) is measured in ohms"
+                ],
+                "formula": "V = I × R",
+                "duration_seconds": 20
+            },
+            {
+                "title": "Understanding Resistance",
+                "description": "Resistance is the opposition to the flow of electric current. In a resistor, resistance is determined by the material, length, and cross-sectional area. Color-coded bands on resistors indicate their resistance value, making it easy to identify components in circuits.",
+                "key_points": [
+                    "Resistance opposes current flow",
+                    "Measured in ohms (Ω)",
+                    "Color bands indicate resistance value",
+                    "Higher resistance = less current flow"
+                ],
+                "duration_seconds": 20
+            },
+            {
+                "title": "Circuit Analysis",
+                "description": "When analyzing circuits with Ohm's Law, we can calculate any one of the three variables (voltage, current, or resistance) if we know the other two. This makes circuit design and troubleshooting much easier. Let's see how voltage, current, and resistance interact in a simple circuit.",
+                "key_points": [
+                    "Calculate voltage: V = I × R",
+                    "Calculate current: I = V / R",
+                    "Calculate resistance: R = V / I",
+                    "All three are interconnected"
+                ],
+                "formula": "I = V / R",
+                "duration_seconds": 25
+            }
+        ]
+        primitives = [
+            {"primitive_id": "resistor", "params": {"value": "10kΩ"}},
+            {"primitive_id": "battery", "params": {"voltage": "9V"}},
+            {"primitive_id": "graph", "params": {}}
+        ]
+    else:
+        steps = [
+            {
+                "title": "Introduction",
+                "description": f"Welcome to this lesson about {topic}. We'll explore the fundamental concepts and build a solid understanding step by step. This topic is important because it forms the foundation for deeper learning.",
+                "key_points": [
+                    "Understanding the basics",
+                    "Key terminology",
+                    "Real-world applications",
+                    "Why this matters"
+                ],
+                "duration_seconds": 20
+            },
+            {
+                "title": "Core Concepts",
+                "description": "Let's dive into the core concepts. We'll break down complex ideas into manageable pieces, using visual aids and examples to make everything clear. Each concept builds on the previous one, creating a comprehensive understanding.",
+                "key_points": [
+                    "Breaking down complex ideas",
+                    "Visual learning aids",
+                    "Step-by-step progression",
+                    "Building understanding"
+                ],
+                "duration_seconds": 25
+            },
+            {
+                "title": "Practical Application",
+                "description": "Now that we understand the theory, let's see how these concepts apply in real-world scenarios. Practical examples help solidify our understanding and show the relevance of what we've learned.",
+                "key_points": [
+                    "Real-world examples",
+                    "Practical applications",
+                    "Connecting theory to practice",
+                    "Hands-on learning"
+                ],
+                "duration_seconds": 25
+            }
+        ]
+        primitives = [
+            {"primitive_id": "graph", "params": {}},
+            {"primitive_id": "graph", "params": {"points": [20, 40, 30, 50, 45, 60], "title": "Progress Over Time"}}
+        ]
+    
+    return orjson.dumps({
+        "topic": topic,
+        "subtopic": "Introduction",
+        "intent": "educational",
+        "audience": "beginner",
+        "suggested_steps": steps,
+        "primitives": primitives,
+        "learning_objectives": ["Understand the core concepts", "Apply knowledge practically", "Build a solid foundation"]
+    })
 
 
-def extract_lesson_structure(prompt: str) -> Dict[str, Any]:
+async def extract_lesson_structure(prompt: str) -> Dict[str, Any]:
     """Extract lesson structure from prompt using Gemini or fallback."""
     try:
-        return gemini_client.extract_lesson_structure(prompt)
+        return await gemini_client.extract_lesson_structure_async(prompt)
     except Exception as e:
         print(f"Gemini extraction failed: {e}, using fallback")
-        prompt_lower = prompt.lower()
-        
-        if "ohm" in prompt_lower or "resistor" in prompt_lower:
-            steps = [
-                {
-                    "title": "Introduction to Ohm's Law",
-                    "description": "Ohm's Law is a fundamental principle in electrical engineering that describes the relationship between voltage, current, and resistance in an electrical circuit. It states that the current through a conductor between two points is directly proportional to the voltage across the two points and inversely proportional to the resistance between them.",
-                    "key_points": [
-                        "Ohm's Law: V = I × R",
-                        "Voltage (V) is measured in volts",
-                        "Current (I) is measured in amperes",
-                        "Resistance (R) is measured in ohms"
-                    ],
-                    "formula": "V = I × R",
-                    "duration_seconds": 20
-                },
-                {
-                    "title": "Understanding Resistance",
-                    "description": "Resistance is the opposition to the flow of electric current. In a resistor, resistance is determined by the material, length, and cross-sectional area. Color-coded bands on resistors indicate their resistance value, making it easy to identify components in circuits.",
-                    "key_points": [
-                        "Resistance opposes current flow",
-                        "Measured in ohms (Ω)",
-                        "Color bands indicate resistance value",
-                        "Higher resistance = less current flow"
-                    ],
-                    "duration_seconds": 20
-                },
-                {
-                    "title": "Circuit Analysis",
-                    "description": "When analyzing circuits with Ohm's Law, we can calculate any one of the three variables (voltage, current, or resistance) if we know the other two. This makes circuit design and troubleshooting much easier. Let's see how voltage, current, and resistance interact in a simple circuit.",
-                    "key_points": [
-                        "Calculate voltage: V = I × R",
-                        "Calculate current: I = V / R",
-                        "Calculate resistance: R = V / I",
-                        "All three are interconnected"
-                    ],
-                    "formula": "I = V / R",
-                    "duration_seconds": 25
-                }
-            ]
-            primitives = [
-                {"primitive_id": "resistor", "params": {"value": "10kΩ"}},
-                {"primitive_id": "battery", "params": {"voltage": "9V"}},
-                {"primitive_id": "graph", "params": {}}
-            ]
-        else:
-            steps = [
-                {
-                    "title": "Introduction",
-                    "description": f"Welcome to this lesson about {prompt[:60]}. We'll explore the fundamental concepts and build a solid understanding step by step. This topic is important because it forms the foundation for deeper learning.",
-                    "key_points": [
-                        "Understanding the basics",
-                        "Key terminology",
-                        "Real-world applications",
-                        "Why this matters"
-                    ],
-                    "duration_seconds": 20
-                },
-                {
-                    "title": "Core Concepts",
-                    "description": "Let's dive into the core concepts. We'll break down complex ideas into manageable pieces, using visual aids and examples to make everything clear. Each concept builds on the previous one, creating a comprehensive understanding.",
-                    "key_points": [
-                        "Breaking down complex ideas",
-                        "Visual learning aids",
-                        "Step-by-step progression",
-                        "Building understanding"
-                    ],
-                    "duration_seconds": 25
-                },
-                {
-                    "title": "Practical Application",
-                    "description": "Now that we understand the theory, let's see how these concepts apply in real-world scenarios. Practical examples help solidify our understanding and show the relevance of what we've learned.",
-                    "key_points": [
-                        "Real-world examples",
-                        "Practical applications",
-                        "Connecting theory to practice",
-                        "Hands-on learning"
-                    ],
-                    "duration_seconds": 25
-                }
-            ]
-            primitives = [
-                {"primitive_id": "graph", "params": {}},
-                {"primitive_id": "graph", "params": {"points": [20, 40, 30, 50, 45, 60], "title": "Progress Over Time"}}
-            ]
-        
-        return {
-            "topic": prompt[:60] if len(prompt) > 60 else prompt,
-            "subtopic": "Introduction",
-            "intent": "educational",
-            "audience": "beginner",
-            "suggested_steps": steps,
-            "primitives": primitives,
-            "learning_objectives": ["Understand the core concepts", "Apply knowledge practically", "Build a solid foundation"]
-        }
+        is_ohm = OHM_KEYWORDS_RE.search(prompt) is not None
+        return orjson.loads(_fallback_structure(prompt[:60], is_ohm))
+
+
+def _partition(n_items: int, n_steps: int) -> Iterator[tuple]:
+    """Yield the (start, end) slice of primitives assigned to each step."""
+    if not n_steps:
+        return
+    if not n_items:
+        for _ in range(n_steps):
+            yield 0, 0
+        return
+    per_step = max(1, n_items // n_steps)
+    for step_idx in range(n_steps):
+        start_idx = step_idx * per_step
+        end_idx = n_items if step_idx == n_steps - 1 else min(start_idx + per_step, n_items)
+        yield start_idx, end_idx
 
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate_lesson(request: GenerateRequest):
+@app.post("/generate")
+async def generate_lesson(request: Request):
     """Generate a lesson from a user prompt."""
+    payload: GenerateRequest = _decode_body(await request.body(), GenerateRequest)
     try:
-        lesson_structure = extract_lesson_structure(request.prompt)
+        lesson_structure = await extract_lesson_structure(payload.prompt)
         
-        lesson_id = str(uuid.uuid4())[:8]
+        lesson_id = secrets.token_hex(4)
         
         timeline = []
         all_primitives = lesson_structure.get("primitives", [])
         steps = lesson_structure.get("suggested_steps", [])
         
         if not all_primitives:
-            prompt_lower = request.prompt.lower()
-            if "resistor" in prompt_lower or "ohm" in prompt_lower or "circuit" in prompt_lower:
+            if CIRCUIT_KEYWORDS_RE.search(payload.prompt):
                 all_primitives = [
                     {"primitive_id": "resistor", "params": {}},
                     {"primitive_id": "battery", "params": {}},
                     {"primitive_id": "graph", "params": {}}
                 ]
-            elif "medical" in prompt_lower or "stethoscope" in prompt_lower:
+            elif MEDICAL_KEYWORDS_RE.search(payload.prompt):
                 all_primitives = [
                     {"primitive_id": "stethoscope", "params": {}},
                     {"primitive_id": "graph", "params": {}}
@@ -328,27 +705,30 @@ async def generate_lesson(request: GenerateRequest):
                     {"primitive_id": "graph", "params": {"points": [20, 40, 30, 50, 45, 60]}}
                 ]
         
-        for step_idx, step in enumerate(steps):
-            step_assets = []
-            
-            if all_primitives:
-                primitives_per_step = max(1, len(all_primitives) // len(steps))
-                start_idx = step_idx * primitives_per_step
-                end_idx = min(start_idx + primitives_per_step, len(all_primitives))
-                
-                if step_idx == len(steps) - 1:
-                    end_idx = len(all_primitives)
-                
-                step_primitives = all_primitives[start_idx:end_idx]
-                
-                if not step_primitives and step_idx < len(all_primitives):
-                    step_primitives = [all_primitives[step_idx % len(all_primitives)]]
-            
-            for primitive_spec in step_primitives:
+        slices = list(_partition(len(all_primitives), len(steps)))
+        
+        unique_specs: Dict[bytes, tuple] = {}
+        step_keys: List[List[bytes]] = []
+        for start_idx, end_idx in slices:
+            keys = []
+            for primitive_spec in all_primitives[start_idx:end_idx]:
                 primitive_id = primitive_spec.get("primitive_id", "graph")
                 params = primitive_spec.get("params", {})
-                asset_data = get_or_generate_primitive(primitive_id, params)
-                step_assets.append(asset_data)
+                spec_key = b"%s:%s" % (primitive_id.encode(), orjson.dumps(params, option=orjson.OPT_SORT_KEYS))
+                unique_specs.setdefault(spec_key, (primitive_id, params))
+                keys.append(spec_key)
+            step_keys.append(keys)
+        
+        results = await _primitives_with_svg(list(unique_specs.values()))
+        assets_by_key = {k: asset_data for k, (asset_data, _) in zip(unique_specs, results)}
+        # SVGs already in hand, so rendering below doesn't go back to disk for them.
+        preloaded_svgs = {
+            asset_data["url"].replace("/assets/", ""): svg_content
+            for asset_data, svg_content in results
+        }
+        
+        for step_idx, step in enumerate(steps):
+            step_assets = [assets_by_key[k] for k in step_keys[step_idx]]
             
             duration = max(15, step.get("duration_seconds", 15))
             
@@ -373,94 +753,258 @@ async def generate_lesson(request: GenerateRequest):
         }
         
         lesson_file = DATA_DIR / f"lesson_{lesson_id}.json"
-        with open(lesson_file, "w") as f:
-            json.dump(lesson_json, f, indent=2)
         
-        try:
-            rendered_html = generate_rendered_html(lesson_json, "")
-            rendered_output_dir = DATA_DIR / "rendered"
-            rendered_output_dir.mkdir(exist_ok=True)
-            rendered_output_file = rendered_output_dir / f"lesson_{lesson_id}.html"
-            with open(rendered_output_file, "w", encoding="utf-8") as f:
-                f.write(rendered_html)
-            print(f"✅ Generated rendered output: {rendered_output_file}")
-        except Exception as e:
-            print(f"⚠️ Warning: Failed to generate rendered output: {e}")
+        async def write_lesson_json():
+            async with aiofiles.open(lesson_file, "wb") as f:
+                await f.write(orjson.dumps(lesson_json, option=orjson.OPT_INDENT_2))
+            _store_lesson(lesson_id, lesson_file.stat().st_mtime_ns, lesson_json)
+        
+        async def write_rendered_html():
+            try:
+                html = generate_rendered_html(lesson_json, "", preloaded_svgs).encode("utf-8")
+                rendered_output_dir = DATA_DIR / "rendered"
+                rendered_output_dir.mkdir(exist_ok=True)
+                rendered_output_file = rendered_output_dir / f"lesson_{lesson_id}.html"
+                async with aiofiles.open(rendered_output_file, "wb") as f:
+                    await f.write(html)
+                _record_rendered(rendered_output_file)
+                print(f"✅ Generated rendered output: {rendered_output_file}")
+            except Exception as e:
+                print(f"⚠️ Warning: Failed to generate rendered output: {e}")
+        
+        await asyncio.gather(write_lesson_json(), write_rendered_html())
         
-        return GenerateResponse(
-            status="ok",
-            lesson_id=lesson_id,
-            render_url=f"/render/{lesson_id}",
-            lesson=lesson_json
+        return Response(
+            content=json_encoder.encode(GenerateResponse(
+                status="ok",
+                lesson_id=lesson_id,
+                render_url=f"/render/{lesson_id}",
+                lesson=lesson_json
+            )),
+            media_type="application/json"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
 
+async def _load_json(path: Path, missing: str) -> Any:
+    """Read a JSON file without blocking the event loop; a missing file is a 404 with `missing`."""
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            return orjson.loads(await f.read())
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=missing)
+
+
+# Decoded copies of the lesson files as msgpack, keyed by the file's mtime so edits made to the
+# files directly (e.g. by enhance_lesson.py) are picked up on the next read.
+db.execute("""
+    CREATE TABLE IF NOT EXISTS lessons (
+        lesson_id TEXT PRIMARY KEY,
+        mtime_ns INTEGER,
+        lesson BLOB
+    )
+""")
+
+
+def _store_lesson(lesson_id: str, mtime_ns: int, lesson: Dict[str, Any]) -> None:
+    with DB_LOCK:
+        db.execute(
+            "INSERT OR REPLACE INTO lessons VALUES (?, ?, ?)",
+            (lesson_id, mtime_ns, msgpack_encoder.encode(lesson))
+        )
+
+
+async def _load_lesson(lesson_id: str, mtime_ns: Optional[int] = None) -> Dict[str, Any]:
+    """Lesson by id, from the lessons table when it's current, else from its file."""
+    if mtime_ns is None:
+        mtime_ns = _lesson_mtime_ns(lesson_id)
+    with DB_LOCK:
+        row = db.execute(
+            "SELECT lesson FROM lessons WHERE lesson_id = ? AND mtime_ns = ?", (lesson_id, mtime_ns)
+        ).fetchone()
+    if row:
+        return msgpack_decoder.decode(row[0])
+    lesson = await _load_json(DATA_DIR / f"lesson_{lesson_id}.json", "Lesson not found")
+    _store_lesson(lesson_id, mtime_ns, lesson)
+    return lesson
+
+
+def _decode_session(raw: bytes) -> Dict[str, Any]:
+    """Validate a session file against SessionData, answering 500 if it's corrupt."""
+    try:
+        return msgspec.structs.asdict(msgspec.json.decode(raw, type=SessionData, strict=False))
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=500, detail=f"Invalid session file: {e}")
+
+
+async def _load_session(session_id: str) -> Dict[str, Any]:
+    try:
+        async with aiofiles.open(SESSIONS_DIR / f"session_{session_id}.json", "rb") as f:
+            raw = await f.read()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return _decode_session(raw)
+
+
 @app.get("/lesson/{lesson_id}")
 async def get_lesson(lesson_id: str):
     """Get lesson JSON by ID."""
-    lesson_file = DATA_DIR / f"lesson_{lesson_id}.json"
-    if not lesson_file.exists():
-        raise HTTPException(status_code=404, detail="Lesson not found")
-    
-    with open(lesson_file, "r") as f:
-        return json.load(f)
+    return await _load_lesson(lesson_id)
+
+
+@lru_cache(maxsize=1024)
+def _asset_etag(asset_file: str) -> str:
+    """Content-hash ETag for an asset; assets are immutable, so it's computed once."""
+    digest = hashlib.blake2b((ASSETS_DIR / asset_file).read_bytes(), digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+
+@lru_cache(maxsize=1024)
+def _asset_gzip(asset_file: str) -> bytes:
+    """Gzipped asset body; assets are immutable, so each is compressed once."""
+    return gzip.compress((ASSETS_DIR / asset_file).read_bytes(), compresslevel=6, mtime=0)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header covers the given ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires.
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
 
 @app.get("/assets/{asset_name}")
-async def get_asset(asset_name: str):
+async def get_asset(asset_name: str, request: StarletteRequest):
     """Serve SVG asset file."""
-    asset_path = ASSETS_DIR / asset_name
-    if not asset_path.exists():
+    if _asset_size(asset_name) is None:
         raise HTTPException(status_code=404, detail="Asset not found")
     
+    headers = {
+        "ETag": _asset_etag(asset_name),
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding"
+    }
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    # Ship the precompressed body; GZipMiddleware passes it through untouched.
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            content=_asset_gzip(asset_name),
+            media_type="image/svg+xml",
+            headers={**headers, "Content-Encoding": "gzip"}
+        )
+    
     return FileResponse(
-        asset_path,
+        ASSETS_DIR / asset_name,
         media_type="image/svg+xml",
-        headers={"Cache-Control": "public, max-age=3600"}
+        headers=headers
     )
 
 
 SESSIONS_DIR = DATA_DIR / "sessions"
 SESSIONS_DIR.mkdir(exist_ok=True)
 
+# Summary columns kept in the sessions index; messages and notes stay in the session files.
+SESSION_INDEX_COLUMNS = ("session_id", "topic", "lesson_id", "session_time", "created_at", "updated_at")
+
+db.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        topic TEXT,
+        lesson_id TEXT,
+        session_time INTEGER,
+        created_at TEXT,
+        updated_at TEXT
+    )
+""")
+db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+
+def _index_session(session_data: Dict[str, Any]) -> None:
+    """Insert or refresh a session's row in the sessions index."""
+    with DB_LOCK:
+        db.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+            tuple(session_data.get(column) for column in SESSION_INDEX_COLUMNS)
+        )
+
+
+def _reconcile_session_index() -> None:
+    """Index session files the table doesn't know about and drop rows whose file is gone."""
+    session_files = {path.stem[len("session_"):]: path for path in SESSIONS_DIR.glob("session_*.json")}
+    with DB_LOCK:
+        indexed = {row[0] for row in db.execute("SELECT session_id FROM sessions")}
+    
+    for session_id in session_files.keys() - indexed:
+        try:
+            with open(session_files[session_id], "rb") as f:
+                _index_session(_decode_session(f.read()))
+        except (OSError, HTTPException) as e:
+            print(f"Warning: Failed to index session {session_id}: {e}")
+    
+    orphaned = indexed - session_files.keys()
+    if orphaned:
+        with DB_LOCK:
+            db.executemany("DELETE FROM sessions WHERE session_id = ?", [(session_id,) for session_id in orphaned])
+
+
+_reconcile_session_index()
+
+
+@lru_cache(maxsize=4)
+def _iso_second(epoch_second: int) -> str:
+    """Local-time ISO prefix (to the second), formatted once per second."""
+    return datetime.datetime.fromtimestamp(epoch_second).isoformat()
+
+
+def _now_iso() -> str:
+    """Current local time in ISO format with microseconds, like datetime.now().isoformat()."""
+    now_us = time.time_ns() // 1000
+    seconds, micros = divmod(now_us, 1_000_000)
+    return f"{_iso_second(seconds)}.{micros:06d}"
+
 
 @app.post("/sessions")
-async def save_session(request: SaveSessionRequest):
+async def save_session(request: Request):
     """Save a session."""
+    payload: SaveSessionRequest = _decode_body(await request.body(), SaveSessionRequest)
     try:
-        session_id = str(uuid.uuid4())[:8]
-        created_at = datetime.datetime.now().isoformat()
+        session_id = secrets.token_hex(4)
+        created_at = _now_iso()
         updated_at = created_at
         
         session_data = {
             "session_id": session_id,
-            "topic": request.topic,
-            "lesson_id": request.lesson_id,
-            "messages": request.messages,
-            "notes": request.notes,
-            "session_time": request.session_time,
+            "topic": payload.topic,
+            "lesson_id": payload.lesson_id,
+            "messages": payload.messages,
+            "notes": payload.notes,
+            "session_time": payload.session_time,
             "created_at": created_at,
             "updated_at": updated_at
         }
         
         session_file = SESSIONS_DIR / f"session_{session_id}.json"
-        with open(session_file, "w") as f:
-            json.dump(session_data, f, indent=2)
+        async with aiofiles.open(session_file, "wb") as f:
+            await f.write(orjson.dumps(session_data, option=orjson.OPT_INDENT_2))
+        _index_session(session_data)
         
-        if request.lesson_id:
+        if payload.lesson_id:
             try:
-                lesson_file = DATA_DIR / f"lesson_{request.lesson_id}.json"
+                lesson_file = DATA_DIR / f"lesson_{payload.lesson_id}.json"
                 if lesson_file.exists():
-                    with open(lesson_file, "r") as f:
-                        lesson = json.load(f)
-                    rendered_html = generate_rendered_html(lesson, "")
+                    lesson = await _load_lesson(payload.lesson_id)
                     rendered_output_dir = DATA_DIR / "rendered"
                     rendered_output_dir.mkdir(exist_ok=True)
                     session_rendered_file = rendered_output_dir / f"session_{session_id}.html"
-                    with open(session_rendered_file, "w", encoding="utf-8") as f:
-                        f.write(rendered_html)
+                    async with aiofiles.open(session_rendered_file, "wb") as f:
+                        await f.write(generate_rendered_html(lesson, "").encode("utf-8"))
+                    _record_rendered(session_rendered_file)
                     print(f"✅ Generated session rendered output: {session_rendered_file}")
             except Exception as e:
                 print(f"⚠️ Warning: Failed to generate session rendered output: {e}")
@@ -471,40 +1015,37 @@ async def save_session(request: SaveSessionRequest):
 
 
 @app.put("/sessions/{session_id}")
-async def update_session(session_id: str, request: SaveSessionRequest):
+async def update_session(session_id: str, request: Request):
     """Update an existing session."""
+    payload: SaveSessionRequest = _decode_body(await request.body(), SaveSessionRequest)
     try:
         session_file = SESSIONS_DIR / f"session_{session_id}.json"
-        if not session_file.exists():
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        with open(session_file, "r") as f:
-            session_data = json.load(f)
+        session_data = await _load_session(session_id)
         
         session_data.update({
-            "topic": request.topic,
-            "lesson_id": request.lesson_id,
-            "messages": request.messages,
-            "notes": request.notes,
-            "session_time": request.session_time,
-            "updated_at": datetime.datetime.now().isoformat()
+            "topic": payload.topic,
+            "lesson_id": payload.lesson_id,
+            "messages": payload.messages,
+            "notes": payload.notes,
+            "session_time": payload.session_time,
+            "updated_at": _now_iso()
         })
         
-        with open(session_file, "w") as f:
-            json.dump(session_data, f, indent=2)
+        async with aiofiles.open(session_file, "wb") as f:
+            await f.write(orjson.dumps(session_data, option=orjson.OPT_INDENT_2))
+        _index_session(session_data)
         
-        if request.lesson_id:
+        if payload.lesson_id:
             try:
-                lesson_file = DATA_DIR / f"lesson_{request.lesson_id}.json"
+                lesson_file = DATA_DIR / f"lesson_{payload.lesson_id}.json"
                 if lesson_file.exists():
-                    with open(lesson_file, "r") as f:
-                        lesson = json.load(f)
-                    rendered_html = generate_rendered_html(lesson, "")
+                    lesson = await _load_lesson(payload.lesson_id)
                     rendered_output_dir = DATA_DIR / "rendered"
                     rendered_output_dir.mkdir(exist_ok=True)
                     session_rendered_file = rendered_output_dir / f"session_{session_id}.html"
-                    with open(session_rendered_file, "w", encoding="utf-8") as f:
-                        f.write(rendered_html)
+                    async with aiofiles.open(session_rendered_file, "wb") as f:
+                        await f.write(generate_rendered_html(lesson, "").encode("utf-8"))
+                    _record_rendered(session_rendered_file)
                     print(f"✅ Updated session rendered output: {session_rendered_file}")
             except Exception as e:
                 print(f"⚠️ Warning: Failed to update session rendered output: {e}")
@@ -519,689 +1060,404 @@ async def update_session(session_id: str, request: SaveSessionRequest):
 @app.get("/sessions/{session_id}")
 async def get_session(session_id: str):
     """Get a session by ID."""
-    session_file = SESSIONS_DIR / f"session_{session_id}.json"
-    if not session_file.exists():
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    with open(session_file, "r") as f:
-        return json.load(f)
+    return await _load_session(session_id)
 
 
 @app.get("/sessions")
-async def list_sessions():
-    """List all sessions."""
-    sessions = []
-    for session_file in SESSIONS_DIR.glob("session_*.json"):
-        with open(session_file, "r") as f:
-            sessions.append(json.load(f))
-    
-    sessions.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-    return {"sessions": sessions}
+async def list_sessions(limit: Optional[int] = None):
+    """List session summaries, most recently updated first. Full sessions come from GET /sessions/{id}."""
+    with DB_LOCK:
+        rows = db.execute(
+            f"SELECT {', '.join(SESSION_INDEX_COLUMNS)} FROM sessions ORDER BY updated_at DESC LIMIT ?",
+            (-1 if limit is None else limit,)
+        ).fetchall()
+    return {"sessions": [dict(zip(SESSION_INDEX_COLUMNS, row)) for row in rows]}
 
 
-def generate_rendered_html(lesson: Dict[str, Any], api_base: str = "") -> str:
-    """Generate fully rendered HTML with animations for a lesson."""
-    from pathlib import Path
-    
-    ASSETS_DIR = Path(__file__).parent / "assets"
+# Assets larger than this are referenced with <img> instead of being read and inlined.
+INLINE_SVG_MAX_BYTES = 20000
+
+
+def _resolve_asset_svgs(
+    lesson: Dict[str, Any],
+    api_base: str = "",
+    preloaded: Optional[Dict[str, str]] = None
+) -> List[List[Optional[str]]]:
+    """
+    Collect the inline markup for every step asset.
+    Non-inlined assets come from `preloaded` (asset file -> SVG) when given, otherwise from disk.
+    """
+    resolved = []
     for step in lesson.get('timeline', []):
+        step_svgs = []
         for asset in step.get('assets', []):
-            if not asset.get('svg') and asset.get('url'):
+            svg = asset.get('svg')
+            if not svg and asset.get('url'):
                 asset_file = asset['url'].replace('/assets/', '')
-                asset_path = ASSETS_DIR / asset_file
-                if asset_path.exists():
-                    with open(asset_path, 'r') as f:
-                        asset['svg'] = f.read()
-    
+                preloaded_svg = preloaded.get(asset_file) if preloaded else None
+                size = len(preloaded_svg.encode("utf-8")) if preloaded_svg is not None else _asset_size(asset_file)
+                if size is None:
+                    svg = None
+                elif size > INLINE_SVG_MAX_BYTES:
+                    svg = f'<img src="{escape(api_base + asset["url"])}" alt="{escape(asset_file)}" loading="lazy">'
+                elif preloaded_svg is not None:
+                    svg = preloaded_svg
+                else:
+                    try:
+                        svg = _read_asset(asset_file)
+                    except OSError:
+                        svg = None
+            step_svgs.append(svg)
+        resolved.append(step_svgs)
+    return resolved
+
+
+def _lesson_context(
+    lesson: Dict[str, Any],
+    api_base: str,
+    preloaded: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """Template variables for lesson_body.html.j2."""
     total_steps = len(lesson.get('timeline', []))
+    lesson_data = orjson.dumps({"lesson_id": lesson.get('lesson_id'), "total_steps": total_steps})
+    return {
+        "lesson": lesson,
+        "svgs": _resolve_asset_svgs(lesson, api_base, preloaded),
+        "total_steps": total_steps,
+        "api_base": api_base,
+        # "<" is escaped so the JSON can't close its <script> element.
+        "lesson_data": Markup(lesson_data.decode().replace("<", "\\u003c"))
+    }
+
+
+@dataclass(slots=True)
+class LessonParts:
+    """A rendered lesson split into the pieces full pages and embeds are assembled from."""
+    title: str
+    style: str
+    body: str
+    script: str
+
+
+def build_lesson_parts(
+    lesson: Dict[str, Any],
+    api_base: str = "",
+    assets_preloaded: Optional[Dict[str, str]] = None
+) -> LessonParts:
+    """Render the lesson-specific body; style and script are the shared runtime."""
+    return LessonParts(
+        title=lesson.get('topic', 'Untitled'),
+        style=LESSON_RUNTIME_CSS,
+        body=LESSON_BODY_TEMPLATE.render(_lesson_context(lesson, api_base, assets_preloaded)),
+        script=LESSON_RUNTIME_JS
+    )
+
+
+def _page_context(parts: LessonParts, api_base: str, inline_runtime: bool) -> Dict[str, Any]:
+    """Template variables for lesson.html.j2."""
+    return {
+        "title": parts.title,
+        "style": Markup(parts.style),
+        "body": Markup(parts.body),
+        "script": Markup(parts.script),
+        "api_base": api_base,
+        "inline_runtime": inline_runtime
+    }
+
+
+def render_full(parts: LessonParts, api_base: str = "", inline_runtime: bool = True) -> str:
+    """Wrap lesson parts in the full <!DOCTYPE html> page."""
+    return LESSON_TEMPLATE.render(_page_context(parts, api_base, inline_runtime))
+
+
+def render_embed(parts: LessonParts) -> str:
+    """Lesson parts as an embeddable fragment, with no document wrapper."""
+    return f"<style>{parts.style}</style>{parts.body}<script>{parts.script}</script>"
+
+
+def iter_rendered_html(lesson: Dict[str, Any], api_base: str = "", inline_runtime: bool = True) -> Iterator[str]:
+    """Yield the animated lesson HTML in chunks as the compiled template renders, step by step."""
+    context = _lesson_context(lesson, api_base)
+    context.update(
+        title=lesson.get('topic', 'Untitled'),
+        style=Markup(LESSON_RUNTIME_CSS),
+        script=Markup(LESSON_RUNTIME_JS),
+        inline_runtime=inline_runtime
+    )
+    stream = LESSON_TEMPLATE.stream(context)
+    stream.enable_buffering(64)
+    return stream
+
+
+def generate_rendered_html(
+    lesson: Dict[str, Any],
+    api_base: str = "",
+    assets_preloaded: Optional[Dict[str, str]] = None,
+    inline_runtime: bool = True
+) -> str:
+    """Generate fully rendered HTML with animations for a lesson."""
+    return render_full(build_lesson_parts(lesson, api_base, assets_preloaded), api_base, inline_runtime)
+
+
+# Bumps whenever the templates or runtime change, so cached pages and ETags roll over on deploy.
+RENDER_VERSION = hashlib.blake2b(
+    Path(LESSON_TEMPLATE.filename).read_bytes()
+    + Path(LESSON_BODY_TEMPLATE.filename).read_bytes()
+    + LESSON_RUNTIME_CSS.encode("utf-8")
+    + LESSON_RUNTIME_JS.encode("utf-8"),
+    digest_size=6
+).hexdigest()
+
+
+# Rendered pages keyed by (lesson_id, mtime_ns, api_base, variant), least recently used first.
+RENDER_CACHE: "OrderedDict[tuple, bytes]" = OrderedDict()
+RENDER_CACHE_SIZE = 256
+# Streamed pages are cached from StreamingResponse's worker thread.
+RENDER_CACHE_LOCK = threading.Lock()
+
+
+def _render_cache_get(key: tuple) -> Optional[bytes]:
+    with RENDER_CACHE_LOCK:
+        html = RENDER_CACHE.get(key)
+        if html is not None:
+            RENDER_CACHE.move_to_end(key)
+    return html
+
+
+def _render_cache_put(key: tuple, html: bytes) -> None:
+    with RENDER_CACHE_LOCK:
+        RENDER_CACHE[key] = html
+        RENDER_CACHE.move_to_end(key)
+        while len(RENDER_CACHE) > RENDER_CACHE_SIZE:
+            RENDER_CACHE.popitem(last=False)
+
+
+async def _render_cached(lesson_id: str, mtime_ns: int, api_base: str, variant: str) -> bytes:
+    """
+    Render a lesson page once per lesson file version.
+    variant is "page" (runtime inlined), "linked" (runtime linked from /static) or "embed".
+    """
+    key = (lesson_id, mtime_ns, api_base, variant)
+    html = _render_cache_get(key)
+    if html is not None:
+        return html
     
-    html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>Animated Lesson: {lesson.get('topic', 'Untitled')}</title>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <script src="https://cdn.jsdelivr.net/npm/animejs@3.2.1/lib/anime.min.js"></script>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        body {{
-            font-family: system-ui, -apple-system, sans-serif;
-            background: linear-gradient(135deg, #1a1a1a 0%, #2d2d2d 100%);
-            color: #fff;
-            min-height: 100vh;
-            padding: 20px;
-        }}
-        .header {{
-            text-align: center;
-            margin-bottom: 30px;
-            padding: 20px;
-            background: rgba(255, 255, 255, 0.05);
-            border-radius: 12px;
-            backdrop-filter: blur(10px);
-        }}
-        .header h1 {{
-            font-size: 2.5rem;
-            margin-bottom: 10px;
-            background: linear-gradient(135deg, #3b82f6, #8b5cf6);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-        }}
-        .controls {{
-            display: flex;
-            gap: 15px;
-            justify-content: center;
-            margin-bottom: 30px;
-            flex-wrap: wrap;
-        }}
-        .btn {{
-            padding: 12px 24px;
-            background: linear-gradient(135deg, #3b82f6, #2563eb);
-            color: white;
-            border: none;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 16px;
-            font-weight: 600;
-            transition: transform 0.2s, box-shadow 0.2s;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-        }}
-        .btn:hover {{
-            transform: translateY(-2px);
-            box-shadow: 0 6px 12px rgba(59, 130, 246, 0.4);
-        }}
-        .btn:active {{
-            transform: translateY(0);
-        }}
-        .btn:disabled {{
-            opacity: 0.5;
-            cursor: not-allowed;
-        }}
-        .step-container {{
-            margin: 40px auto;
-            max-width: 1200px;
-            padding: 30px;
-            background: rgba(255, 255, 255, 0.05);
-            border-radius: 16px;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(10px);
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-            display: none;
-        }}
-        .step-container.active {{
-            display: block;
-            animation: fadeIn 0.5s ease-in;
-        }}
-        @keyframes fadeIn {{
-            from {{
-                opacity: 0;
-                transform: translateY(20px);
-            }}
-            to {{
-                opacity: 1;
-                transform: translateY(0);
-            }}
-        }}
-        .step-title {{
-            font-size: 2rem;
-            font-weight: bold;
-            margin-bottom: 15px;
-            color: #fff;
-            text-align: center;
-        }}
-        .step-description {{
-            font-size: 1.1rem;
-            line-height: 1.6;
-            color: #d1d5db;
-            margin-bottom: 25px;
-            text-align: center;
-        }}
-        .key-points {{
-            margin: 25px 0;
-            padding: 20px;
-            background: rgba(59, 130, 246, 0.1);
-            border-left: 4px solid #3b82f6;
-            border-radius: 8px;
-        }}
-        .key-points h3 {{
-            font-size: 1.2rem;
-            margin-bottom: 15px;
-            color: #93c5fd;
-        }}
-        .key-points ul {{
-            list-style: none;
-            padding: 0;
-        }}
-        .key-points li {{
-            padding: 10px 0;
-            padding-left: 30px;
-            position: relative;
-            color: #e5e7eb;
-            font-size: 1rem;
-            opacity: 0;
-            transform: translateX(-20px);
-        }}
-        .key-points li:before {{
-            content: "✓";
-            position: absolute;
-            left: 0;
-            color: #3b82f6;
-            font-size: 1.2rem;
-            font-weight: bold;
-        }}
-        .formula-box {{
-            margin: 25px 0;
-            padding: 20px;
-            background: linear-gradient(135deg, rgba(139, 92, 246, 0.2), rgba(59, 130, 246, 0.2));
-            border: 2px solid #8b5cf6;
-            border-radius: 12px;
-            text-align: center;
-            font-family: 'Courier New', monospace;
-            font-size: 1.5rem;
-            font-weight: bold;
-            color: #c4b5fd;
-            opacity: 0;
-            transform: scale(0.9);
-        }}
-        .asset-container {{
-            margin: 30px 0;
-            padding: 30px;
-            background: rgba(0, 0, 0, 0.3);
-            border-radius: 12px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 300px;
-            overflow: hidden;
-        }}
-        .asset-container svg {{
-            max-width: 100%;
-            height: auto;
-            display: block !important;
-            visibility: visible !important;
-            opacity: 0;
-            transform: scale(0.8);
-        }}
-        .progress-bar {{
-            position: fixed;
-            bottom: 0;
-            left: 0;
-            right: 0;
-            height: 4px;
-            background: rgba(255, 255, 255, 0.1);
-            z-index: 1000;
-        }}
-        .progress-fill {{
-            height: 100%;
-            background: linear-gradient(90deg, #3b82f6, #8b5cf6);
-            width: 0%;
-            transition: width 0.3s ease;
-        }}
-        .step-indicator {{
-            text-align: center;
-            margin-top: 20px;
-            color: #9ca3af;
-            font-size: 0.9rem;
-        }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>{lesson.get('topic', 'Untitled Lesson')}</h1>
-        <p style="color: #9ca3af;">Lesson ID: {lesson.get('lesson_id', 'N/A')}</p>
-    </div>
-    
-    <div class="controls">
-        <button class="btn" id="play-btn" onclick="playAnimation()">▶ Play</button>
-        <button class="btn" id="pause-btn" onclick="pauseAnimation()" disabled>⏸ Pause</button>
-        <button class="btn" id="prev-btn" onclick="previousStep()">⏮ Previous</button>
-        <button class="btn" id="next-btn" onclick="nextStep()">Next ⏭</button>
-        <button class="btn" id="restart-btn" onclick="restartAnimation()">↻ Restart</button>
-    </div>
-    
-    <div id="lesson-timeline">
-"""
-    
-    for step_idx, step in enumerate(lesson.get('timeline', [])):
-        html += f"""
-        <div class="step-container" id="step-{step_idx}" {'class="active"' if step_idx == 0 else ''}>
-            <div class="step-title">{step.get('title', f'Step {step_idx + 1}')}</div>
-            <div class="step-description">{step.get('description', '')}</div>
-"""
-        if step.get('key_points'):
-            html += """
-            <div class="key-points">
-                <h3>Key Points:</h3>
-                <ul>
-"""
-            for point in step['key_points']:
-                html += f'                    <li>{point}</li>\n'
-            html += """
-                </ul>
-            </div>
-"""
-        
-        if step.get('formula'):
-            html += f"""
-            <div class="formula-box" id="formula-{step_idx}">
-                {step['formula']}
-            </div>
-"""
-        
-        for asset_idx, asset in enumerate(step.get('assets', [])):
-            html += f"""
-            <div class="asset-container" id="asset-{step_idx}-{asset_idx}">
-"""
-            if asset.get('svg'):
-                html += asset['svg']
-            elif asset.get('url'):
-                html += f'<p style="color: #999;">Loading asset from {asset["url"]}...</p>'
-            else:
-                html += '<p style="color: #999;">No asset available</p>'
-            html += """
-            </div>
-"""
-        
-        html += f"""
-            <div class="step-indicator">Step {step_idx + 1} of {total_steps} • Duration: {step.get('duration_seconds', 15)}s</div>
-        </div>
-"""
-    
-    html += """
-    </div>
-    
-    <div class="progress-bar">
-        <div class="progress-fill" id="progress-fill"></div>
-    </div>
-    
-    <script>
-        let currentStep = 0;
-        let isPlaying = false;
-        let animationTimers = [];
-        const totalSteps = """ + str(total_steps) + """;
-        
-        function showStep(stepIndex) {
-            // Hide all steps
-            document.querySelectorAll('.step-container').forEach((step, idx) => {
-                step.classList.remove('active');
-                if (idx === stepIndex) {
-                    step.classList.add('active');
-                }
-            });
-            
-            // Update progress
-            const progress = ((stepIndex + 1) / totalSteps) * 100;
-            document.getElementById('progress-fill').style.width = progress + '%';
-            
-            // Animate current step
-            animateStep(stepIndex);
-        }
-        
-        function animateStep(stepIndex) {
-            const stepContainer = document.getElementById('step-' + stepIndex);
-            if (!stepContainer) return;
-            
-            // Clear previous timers
-            animationTimers.forEach(timer => clearTimeout(timer));
-            animationTimers = [];
-            
-            console.log('Animating step', stepIndex);
-            
-            // Animate key points
-            const keyPoints = stepContainer.querySelectorAll('.key-points li');
-            keyPoints.forEach((point, idx) => {
-                const timer = setTimeout(() => {
-                    anime({
-                        targets: point,
-                        opacity: [0, 1],
-                        transform: ['translateX(-20px)', 'translateX(0)'],
-                        duration: 600,
-                        easing: 'easeOutQuad'
-                    });
-                }, 500 + (idx * 200));
-                animationTimers.push(timer);
-            });
-            
-            // Animate formula
-            const formula = stepContainer.querySelector('.formula-box');
-            if (formula) {
-                const timer = setTimeout(() => {
-                    anime({
-                        targets: formula,
-                        opacity: [0, 1],
-                        scale: [0.9, 1],
-                        duration: 800,
-                        easing: 'easeOutQuad'
-                    });
-                }, 1000);
-                animationTimers.push(timer);
-            }
-            
-            // Animate SVGs
-            const svgs = stepContainer.querySelectorAll('.asset-container svg');
-            svgs.forEach((svg, svgIdx) => {
-                const timer = setTimeout(() => {
-                    // Fade in and zoom SVG
-                    anime({
-                        targets: svg,
-                        opacity: [0, 1],
-                        scale: [0.8, 1],
-                        duration: 2000,
-                        easing: 'easeOutQuad'
-                    });
-                    
-                    // Animate paths
-                    const paths = svg.querySelectorAll('path');
-                    paths.forEach((path, pIdx) => {
-                        const length = path.getTotalLength();
-                        if (length > 0) {
-                            path.style.strokeDasharray = length;
-                            path.style.strokeDashoffset = length;
-                            anime({
-                                targets: path,
-                                strokeDashoffset: [length, 0],
-                                duration: 2500,
-                                delay: 500 + (pIdx * 150),
-                                easing: 'easeInOutQuad'
-                            });
-                        }
-                    });
-                    
-                    // Animate lines
-                    const lines = svg.querySelectorAll('line');
-                    lines.forEach((line, lIdx) => {
-                        line.style.opacity = '0';
-                        anime({
-                            targets: line,
-                            opacity: [0, 1],
-                            duration: 1000,
-                            delay: 800 + (lIdx * 150),
-                            easing: 'easeOutQuad'
-                        });
-                    });
-                    
-                    // Animate rectangles (text boxes)
-                    const rects = svg.querySelectorAll('rect');
-                    rects.forEach((rect, rIdx) => {
-                        rect.style.opacity = '0';
-                        anime({
-                            targets: rect,
-                            opacity: [0, 1],
-                            duration: 1000,
-                            delay: 1000 + (rIdx * 150),
-                            easing: 'easeOutQuad'
-                        });
-                    });
-                    
-                    // Animate text elements
-                    const texts = svg.querySelectorAll('text');
-                    texts.forEach((text, tIdx) => {
-                        text.style.opacity = '0';
-                        anime({
-                            targets: text,
-                            opacity: [0, 1],
-                            duration: 800,
-                            delay: 1200 + (tIdx * 100),
-                            easing: 'easeOutQuad'
-                        });
-                    });
-                    
-                    // Animate circles
-                    const circles = svg.querySelectorAll('circle');
-                    circles.forEach((circle, cIdx) => {
-                        circle.style.opacity = '0';
-                        anime({
-                            targets: circle,
-                            opacity: [0, 1],
-                            scale: [0.8, 1],
-                            duration: 800,
-                            delay: 1000 + (cIdx * 100),
-                            easing: 'easeOutQuad'
-                        });
-                    });
-                }, svgIdx * 300);
-                animationTimers.push(timer);
-            });
-        }
-        
-        function playAnimation() {
-            if (isPlaying) return;
-            isPlaying = true;
-            document.getElementById('play-btn').disabled = true;
-            document.getElementById('pause-btn').disabled = false;
-            
-            const step = document.getElementById('step-' + currentStep);
-            if (step) {
-                const duration = parseInt(step.querySelector('.step-indicator').textContent.match(/Duration: (\\d+)s/)[1]) * 1000;
-                
-                const timer = setTimeout(() => {
-                    if (currentStep < totalSteps - 1) {
-                        nextStep();
-                    } else {
-                        pauseAnimation();
-                    }
-                }, duration);
-                animationTimers.push(timer);
-            }
-        }
-        
-        function pauseAnimation() {
-            isPlaying = false;
-            document.getElementById('play-btn').disabled = false;
-            document.getElementById('pause-btn').disabled = true;
-            animationTimers.forEach(timer => clearTimeout(timer));
-            animationTimers = [];
-        }
-        
-        function nextStep() {
-            if (currentStep < totalSteps - 1) {
-                currentStep++;
-                showStep(currentStep);
-                if (isPlaying) {
-                    playAnimation();
-                }
-            }
-        }
-        
-        function previousStep() {
-            if (currentStep > 0) {
-                currentStep--;
-                showStep(currentStep);
-                if (isPlaying) {
-                    playAnimation();
-                }
-            }
-        }
-        
-        function restartAnimation() {
-            pauseAnimation();
-            currentStep = 0;
-            showStep(currentStep);
-        }
-        
-        // Initialize
-        showStep(0);
-        
-        // Auto-play on load
-        setTimeout(() => {
-            playAnimation();
-        }, 1000);
-    </script>
-</body>
-</html>
-"""
+    lesson = await _load_lesson(lesson_id, mtime_ns)
+    parts = build_lesson_parts(lesson, api_base)
+    if variant == "embed":
+        html = render_embed(parts).encode("utf-8")
+    else:
+        html = render_full(parts, api_base, inline_runtime=variant == "page").encode("utf-8")
+    _render_cache_put(key, html)
     return html
 
 
+def _stream_into_cache(key: tuple, chunks: Iterator[str]) -> Iterator[bytes]:
+    """Pass rendered chunks through to the client, caching the page once it completes."""
+    encoded = []
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        encoded.append(data)
+        yield data
+    _render_cache_put(key, b"".join(encoded))
+
+
+def _lesson_mtime_ns(lesson_id: str) -> int:
+    """mtime of a lesson file, raising 404 if it doesn't exist."""
+    try:
+        return (DATA_DIR / f"lesson_{lesson_id}.json").stat().st_mtime_ns
+    except OSError:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+
+
+def _html_etag(version: int, variant: str) -> str:
+    # variant keeps the page and embed fragment of one lesson version from sharing an ETag.
+    return f'W/"{version:x}-{variant}-{RENDER_VERSION}"'
+
+
+def _conditional_html(request: StarletteRequest, content: bytes, version: int, variant: str) -> Response:
+    """HTMLResponse with a weak ETag, or a bodyless 304 if the client already has it."""
+    etag = _html_etag(version, variant)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return HTMLResponse(content=content, headers={"ETag": etag})
+
+
+async def _session_lesson_id(session_id: str) -> str:
+    """lesson_id a session points at, raising 404 if either is missing."""
+    with DB_LOCK:
+        row = db.execute("SELECT lesson_id FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+    if row is not None:
+        lesson_id = row[0]
+    else:
+        # Not indexed yet (e.g. written since startup by another process): read the file and index it.
+        session_data = await _load_session(session_id)
+        _index_session(session_data)
+        lesson_id = session_data["lesson_id"]
+    
+    if not lesson_id:
+        raise HTTPException(status_code=404, detail="Session has no associated lesson")
+    return lesson_id
+
+
+async def _embed_response(request: StarletteRequest, lesson_id: str) -> Response:
+    """Embed fragment for a lesson, shared by the lesson and session embed routes."""
+    mtime_ns = _lesson_mtime_ns(lesson_id)
+    return _conditional_html(request, await _render_cached(lesson_id, mtime_ns, "", "embed"), mtime_ns, "embed")
+
+
 @app.get("/render/{lesson_id}", response_class=HTMLResponse)
 async def render_lesson(lesson_id: str, request: StarletteRequest):
     """HTML preview page for a lesson with full animations."""
-    lesson_file = DATA_DIR / f"lesson_{lesson_id}.json"
-    if not lesson_file.exists():
-        raise HTTPException(status_code=404, detail="Lesson not found")
+    mtime_ns = _lesson_mtime_ns(lesson_id)
+    api_base = str(request.base_url).rstrip('/') if hasattr(request, 'base_url') else ""
+    # Served pages link the shared runtime so browsers cache it across lessons.
+    key = (lesson_id, mtime_ns, api_base, "linked")
+    html = _render_cache_get(key)
+    if html is not None:
+        return _conditional_html(request, html, mtime_ns, "linked")
     
-    with open(lesson_file, "r") as f:
-        lesson = json.load(f)
+    etag = _html_etag(mtime_ns, "linked")
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
     
-    api_base = str(request.base_url).rstrip('/') if hasattr(request, 'base_url') else ""
-    html = generate_rendered_html(lesson, api_base)
-    return HTMLResponse(content=html)
+    # Cache miss: stream the page as it renders so the browser can start on the head early.
+    lesson = await _load_lesson(lesson_id, mtime_ns)
+    return StreamingResponse(
+        _stream_into_cache(key, iter_rendered_html(lesson, api_base, inline_runtime=False)),
+        media_type="text/html",
+        headers={"ETag": etag}
+    )
 
 
 @app.get("/render/{lesson_id}/embed", response_class=HTMLResponse)
-async def render_lesson_embed(lesson_id: str):
+async def render_lesson_embed(lesson_id: str, request: StarletteRequest):
     """Embeddable HTML content for a lesson (with inline styles)."""
-    lesson_file = DATA_DIR / f"lesson_{lesson_id}.json"
-    if not lesson_file.exists():
-        raise HTTPException(status_code=404, detail="Lesson not found")
-    
-    with open(lesson_file, "r") as f:
-        lesson = json.load(f)
-    
-    html = generate_rendered_html(lesson, "")
-    
-    import re
-    style_match = re.search(r'<style[^>]*>(.*?)</style>', html, re.DOTALL)
-    body_match = re.search(r'<body[^>]*>(.*)</body>', html, re.DOTALL)
-    script_match = re.search(r'<script[^>]*>(.*?)</script>', html, re.DOTALL)
-    
-    embed_content = ""
-    if style_match:
-        embed_content += f"<style>{style_match.group(1)}</style>"
-    if body_match:
-        embed_content += body_match.group(1)
-    if script_match:
-        embed_content += f"<script>{script_match.group(1)}</script>"
-    
-    if embed_content:
-        return HTMLResponse(content=embed_content)
-    return HTMLResponse(content=html)
+    return await _embed_response(request, lesson_id)
 
 
 @app.get("/sessions/{session_id}/render", response_class=HTMLResponse)
 async def render_session(session_id: str, request: StarletteRequest):
     """Get rendered HTML output for a session."""
-    session_file = SESSIONS_DIR / f"session_{session_id}.json"
-    if not session_file.exists():
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    with open(session_file, "r") as f:
-        session_data = json.load(f)
-    
-    lesson_id = session_data.get("lesson_id")
-    if not lesson_id:
-        raise HTTPException(status_code=404, detail="Session has no associated lesson")
+    lesson_id = await _session_lesson_id(session_id)
     
     rendered_output_dir = DATA_DIR / "rendered"
     session_rendered_file = rendered_output_dir / f"session_{session_id}.html"
     
-    if session_rendered_file.exists():
-        with open(session_rendered_file, "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
-    else:
-        lesson_file = DATA_DIR / f"lesson_{lesson_id}.json"
-        if not lesson_file.exists():
-            raise HTTPException(status_code=404, detail="Lesson not found")
-        
-        with open(lesson_file, "r") as f:
-            lesson = json.load(f)
-        
-        api_base = str(request.base_url).rstrip('/')
-        html = generate_rendered_html(lesson, api_base)
-        
-        rendered_output_dir.mkdir(exist_ok=True)
-        with open(session_rendered_file, "w", encoding="utf-8") as f:
-            f.write(html)
-        
-        return HTMLResponse(content=html)
+    # The saved page (written when the session was saved) acts as a second cache level.
+    try:
+        mtime_ns = session_rendered_file.stat().st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    if mtime_ns is not None:
+        key = (session_id, mtime_ns, "", "session-file")
+        html = _render_cache_get(key)
+        if html is None:
+            async with aiofiles.open(session_rendered_file, "rb") as f:
+                html = await f.read()
+            _render_cache_put(key, html)
+        return _conditional_html(request, html, mtime_ns, "session")
+    
+    lesson_mtime_ns = _lesson_mtime_ns(lesson_id)
+    api_base = str(request.base_url).rstrip('/')
+    html = await _render_cached(lesson_id, lesson_mtime_ns, api_base, "page")
+    
+    rendered_output_dir.mkdir(exist_ok=True)
+    async with aiofiles.open(session_rendered_file, "wb") as f:
+        await f.write(html)
+    _record_rendered(session_rendered_file)
+    
+    return _conditional_html(request, html, session_rendered_file.stat().st_mtime_ns, "session")
 
 
 @app.get("/sessions/{session_id}/render/embed", response_class=HTMLResponse)
-async def render_session_embed(session_id: str):
+async def render_session_embed(session_id: str, request: StarletteRequest):
     """Get embeddable rendered HTML for a session."""
-    session_file = SESSIONS_DIR / f"session_{session_id}.json"
-    if not session_file.exists():
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    with open(session_file, "r") as f:
-        session_data = json.load(f)
-    
-    lesson_id = session_data.get("lesson_id")
-    if not lesson_id:
-        raise HTTPException(status_code=404, detail="Session has no associated lesson")
-    
-    lesson_file = DATA_DIR / f"lesson_{lesson_id}.json"
-    if not lesson_file.exists():
-        raise HTTPException(status_code=404, detail="Lesson not found")
-    
-    with open(lesson_file, "r") as f:
-        lesson = json.load(f)
-    
-    html = generate_rendered_html(lesson, "")
-    
-    import re
-    style_match = re.search(r'<style[^>]*>(.*?)</style>', html, re.DOTALL)
-    body_match = re.search(r'<body[^>]*>(.*)</body>', html, re.DOTALL)
-    script_match = re.search(r'<script[^>]*>(.*?)</script>', html, re.DOTALL)
-    
-    embed_content = ""
-    if style_match:
-        embed_content += f"<style>{style_match.group(1)}</style>"
-    if body_match:
-        embed_content += body_match.group(1)
-    if script_match:
-        embed_content += f"<script>{script_match.group(1)}</script>"
-    
-    if embed_content:
-        return HTMLResponse(content=embed_content)
-    return HTMLResponse(content=html)
+    return await _embed_response(request, await _session_lesson_id(session_id))
+
+
+RENDERED_DIR = DATA_DIR / "rendered"
+
+# filename -> listing entry for data/rendered. Rebuilt with one scandir pass when the directory's
+# mtime moves (files added or removed elsewhere); the app's own writes update it in place.
+RENDERED_INDEX: Dict[str, Dict[str, Any]] = {}
+RENDERED_DIR_MTIME_NS: Optional[int] = None
+RENDERED_SORTED: Optional[List[Dict[str, Any]]] = None
+
+
+def _rendered_entry(filename: str, stat: os.stat_result) -> Dict[str, Any]:
+    file_type = "lesson" if filename.startswith("lesson_") else "session"
+    file_id = filename[:-len(".html")].replace("lesson_", "").replace("session_", "")
+    return {
+        "filename": filename,
+        "id": file_id,
+        "type": file_type,
+        "size": stat.st_size,
+        "created": datetime.datetime.fromtimestamp(stat.st_ctime).isoformat(),
+        "modified": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        "url": f"/rendered/{filename}",
+        "render_url": f"/render/{file_id}" if file_type == "lesson" else f"/sessions/{file_id}/render"
+    }
+
+
+def _record_rendered(path: Path) -> None:
+    """Update the rendered index after writing a file into data/rendered."""
+    global RENDERED_DIR_MTIME_NS, RENDERED_SORTED
+    RENDERED_INDEX[path.name] = _rendered_entry(path.name, path.stat())
+    RENDERED_SORTED = None
+    # Our own write moved the directory mtime; don't let it force a full rescan.
+    # Before the first listing there's no index to keep, so leave the scan to _rendered_listing.
+    if RENDERED_DIR_MTIME_NS is not None:
+        RENDERED_DIR_MTIME_NS = os.stat(RENDERED_DIR).st_mtime_ns
+
+
+def _rendered_listing() -> List[Dict[str, Any]]:
+    """Rendered files, newest first."""
+    global RENDERED_DIR_MTIME_NS, RENDERED_SORTED
+    RENDERED_DIR.mkdir(exist_ok=True)
+    dir_mtime_ns = os.stat(RENDERED_DIR).st_mtime_ns
+    if dir_mtime_ns != RENDERED_DIR_MTIME_NS:
+        with os.scandir(RENDERED_DIR) as entries:
+            index = {
+                entry.name: _rendered_entry(entry.name, entry.stat())
+                for entry in entries
+                if entry.name.endswith(".html") and entry.is_file()
+            }
+        RENDERED_INDEX.clear()
+        RENDERED_INDEX.update(index)
+        RENDERED_DIR_MTIME_NS = dir_mtime_ns
+        RENDERED_SORTED = None
+    if RENDERED_SORTED is None:
+        RENDERED_SORTED = sorted(RENDERED_INDEX.values(), key=lambda x: x["modified"], reverse=True)
+    return RENDERED_SORTED
 
 
 @app.get("/rendered")
 async def list_rendered_outputs():
     """List all rendered output files."""
-    rendered_output_dir = DATA_DIR / "rendered"
-    rendered_output_dir.mkdir(exist_ok=True)
-    
-    rendered_files = []
-    for file in rendered_output_dir.glob("*.html"):
-        stat = file.stat()
-        file_type = "lesson" if file.name.startswith("lesson_") else "session"
-        file_id = file.stem.replace("lesson_", "").replace("session_", "")
-        
-        rendered_files.append({
-            "filename": file.name,
-            "id": file_id,
-            "type": file_type,
-            "size": stat.st_size,
-            "created": datetime.datetime.fromtimestamp(stat.st_ctime).isoformat(),
-            "modified": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-            "url": f"/rendered/{file.name}",
-            "render_url": f"/render/{file_id}" if file_type == "lesson" else f"/sessions/{file_id}/render"
-        })
-    
-    rendered_files.sort(key=lambda x: x["modified"], reverse=True)
-    
+    rendered_files = _rendered_listing()
     return {"rendered_files": rendered_files, "count": len(rendered_files)}
 
 
 @app.get("/rendered/{filename}")
-async def get_rendered_output(filename: str):
+async def get_rendered_output(filename: str, request: StarletteRequest):
     """Get a specific rendered output file."""
-    rendered_output_dir = DATA_DIR / "rendered"
-    rendered_file = rendered_output_dir / filename
+    rendered_file = RENDERED_DIR / filename
     
-    if not rendered_file.exists():
+    try:
+        stat = rendered_file.stat()
+    except OSError:
         raise HTTPException(status_code=404, detail="Rendered file not found")
     
     if not filename.endswith(".html"):
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    with open(rendered_file, "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+    # Session pages are rewritten in place, so clients revalidate (cheaply, via 304) instead of
+    # trusting a max-age.
+    headers = {"ETag": f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"', "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(rendered_file, media_type="text/html", headers=headers, stat_result=stat)
 
 
 if __name__ == "__main__":
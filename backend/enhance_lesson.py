@@ -1,9 +1,11 @@
 """
 Script to enhance an existing lesson with key_points and formulas for testing.
 """
-import json
+import os
 from pathlib import Path
 
+import orjson
+
 DATA_DIR = Path(__file__).parent / "data"
 
 def enhance_lesson(lesson_id):
@@ -14,8 +16,7 @@ def enhance_lesson(lesson_id):
         print(f"Lesson file not found: {lesson_file}")
         return
     
-    with open(lesson_file, "r") as f:
-        lesson = json.load(f)
+    lesson = orjson.loads(lesson_file.read_bytes())
     
     for step in lesson.get('timeline', []):
         if step.get('title', '').lower().startswith('introduction'):
@@ -45,8 +46,10 @@ def enhance_lesson(lesson_id):
             step['formula'] = "I = V / R"
             step['description'] = "When analyzing circuits with Ohm's Law, we can calculate any one of the three variables (voltage, current, or resistance) if we know the other two. This makes circuit design and troubleshooting much easier."
     
-    with open(lesson_file, "w") as f:
-        json.dump(lesson, f, indent=2)
+    # Write a sibling temp file and swap it in, so a crash never leaves a half-written lesson.
+    tmp_file = lesson_file.with_suffix(".json.tmp")
+    tmp_file.write_bytes(orjson.dumps(lesson, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, lesson_file)
     
     print(f"✅ Enhanced lesson {lesson_id}")
     print(f"   Added key_points and formulas to {len(lesson.get('timeline', []))} steps")
@@ -1,56 +1,88 @@
 """
 Parametric SVG generators for fallback primitives.
 """
-from typing import Dict, Any
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Hashable, Tuple
 
+# (primitive_id, frozen params) -> (SVG, digest), least recently used first. Output depends
+# only on those, so repeats are a lookup; graph points are arbitrary, so the size is capped.
+_SVG_CACHE: "OrderedDict[tuple, Tuple[str, str]]" = OrderedDict()
+_SVG_CACHE_SIZE = 256
+_SVG_CACHE_LOCK = threading.Lock()  # generate() runs in worker threads
 
-class ParametricSVGGenerator:
-    """Generate parametric SVG primitives."""
-    
-    def generate(self, primitive_id: str, params: Dict[str, Any] = None) -> str:
-        """Generate SVG for a primitive type."""
-        params = params or {}
-        
-        if primitive_id == "resistor":
-            return self._generate_resistor(params)
-        elif primitive_id == "battery":
-            return self._generate_battery(params)
-        elif primitive_id == "stethoscope":
-            return self._generate_stethoscope(params)
-        elif primitive_id == "graph":
-            return self._generate_graph(params)
-        else:
-            return self._generate_graph(params)  # Default fallback
-    
-    def _generate_resistor(self, params: Dict[str, Any]) -> str:
-        """Generate resistor SVG with text box."""
-        value = params.get("value", "10kΩ")
-        width = 400
-        height = 200
-        
-        return f'''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
+
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_INDENT_RE = re.compile(r'^[ \t]+', re.MULTILINE)
+_WS_RE = re.compile(r'(?<=[>}])\s+(?=[<{])')  # between tags and/or format fields
+
+
+def _minify(svg: str) -> str:
+    """Strip comments and the whitespace between tags."""
+    svg = _COMMENT_RE.sub('', svg)
+    svg = _INDENT_RE.sub('', svg)
+    return _WS_RE.sub('', svg)
+
+
+# Graphs with at least this many points scale them with NumPy, when it's installed.
+_NUMPY_MIN_POINTS = 32
+_np: Any = None  # numpy once imported (lazily, to keep startup light); False if unavailable
+
+
+def _scaled_points(points: list, max_val: float) -> list:
+    """int((p / max_val) * 200) for every point."""
+    global _np
+    if len(points) >= _NUMPY_MIN_POINTS:
+        if _np is None:
+            try:
+                import numpy
+                _np = numpy
+            except ImportError:
+                _np = False
+        if _np:
+            return ((_np.asarray(points, dtype=_np.float64) / max_val) * 200).astype(_np.int64).tolist()
+    return [int((p / max_val) * 200) for p in points]
+
+
+def _freeze(value: Any) -> Hashable:
+    """Hashable form of a params value: dicts become sorted item tuples, lists become tuples.
+    Scalars carry their type, since 1, 1.0 and True compare equal but render differently."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return (type(value).__name__, value)
+
+
+# Drop shadow shared by every primitive's text boxes.
+_SHADOW_DEF = '<filter id="shadow"><feDropShadow dx="2" dy="2" stdDeviation="3" flood-opacity="0.3"/></filter>'
+
+# Primitive SVGs, filled in with str.format_map. Placeholders name precomputed values since
+# format fields can't hold expressions. Templates are minified once here, so param values
+# are inserted untouched.
+_RESISTOR_SVG = _minify('''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
   <defs>
     <linearGradient id="resistorGrad" x1="0%" y1="0%" x2="100%" y2="0%">
       <stop offset="0%" style="stop-color:#8B4513;stop-opacity:1" />
       <stop offset="50%" style="stop-color:#A0522D;stop-opacity:1" />
       <stop offset="100%" style="stop-color:#8B4513;stop-opacity:1" />
     </linearGradient>
-    <filter id="shadow">
-      <feDropShadow dx="2" dy="2" stdDeviation="3" flood-opacity="0.3"/>
-    </filter>
+    {shadow_def}
   </defs>
   <!-- Background -->
   <rect width="{width}" height="{height}" fill="#f5f5f5" rx="8"/>
   
   <!-- Text box -->
   <rect x="20" y="20" width="360" height="60" fill="#fff" stroke="#3b82f6" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="45" font-family="Arial, sans-serif" font-size="16" font-weight="bold" fill="#1e40af" text-anchor="middle" opacity="0">Resistor Component</text>
-  <text x="{width/2}" y="65" font-family="Arial, sans-serif" font-size="14" fill="#4b5563" text-anchor="middle" opacity="0">Resistance: {value}</text>
+  <text x="{half_w}" y="45" font-family="Arial, sans-serif" font-size="16" font-weight="bold" fill="#1e40af" text-anchor="middle" opacity="0">Resistor Component</text>
+  <text x="{half_w}" y="65" font-family="Arial, sans-serif" font-size="14" fill="#4b5563" text-anchor="middle" opacity="0">Resistance: {value}</text>
   
   <!-- Circuit diagram -->
   <g transform="translate(50, 120)">
-    <!-- Left wire -->
-    <line x1="0" y1="0" x2="60" y2="0" stroke="#333" stroke-width="4" stroke-linecap="round"/>
+    <!-- Left and right wires -->
+    <path d="M 0 0 L 60 0 M 200 0 L 260 0" fill="none" stroke="#333" stroke-width="4" stroke-linecap="round"/>
     <!-- Resistor body -->
     <rect x="60" y="-25" width="140" height="50" fill="url(#resistorGrad)" stroke="#654321" stroke-width="3" rx="6" opacity="0"/>
     <!-- Color bands -->
@@ -58,44 +90,34 @@ class ParametricSVGGenerator:
     <rect x="95" y="-25" width="10" height="50" fill="#8B0000" opacity="0"/>
     <rect x="115" y="-25" width="10" height="50" fill="#FFD700" opacity="0"/>
     <rect x="135" y="-25" width="10" height="50" fill="#C0C0C0" opacity="0"/>
-    <!-- Right wire -->
-    <line x1="200" y1="0" x2="260" y2="0" stroke="#333" stroke-width="4" stroke-linecap="round"/>
     <!-- Value label below -->
     <text x="130" y="40" font-family="Arial, sans-serif" font-size="14" font-weight="bold" fill="#1e40af" text-anchor="middle" opacity="0">{value}</text>
   </g>
   
   <!-- Formula box (if applicable) -->
   <rect x="20" y="140" width="360" height="40" fill="#e0e7ff" stroke="#6366f1" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="165" font-family="Arial, sans-serif" font-size="14" fill="#4338ca" text-anchor="middle" opacity="0">R = Resistance (Ω)</text>
-</svg>'''
-    
-    def _generate_battery(self, params: Dict[str, Any]) -> str:
-        """Generate battery SVG with text box."""
-        voltage = params.get("voltage", "9V")
-        width = 400
-        height = 250
-        
-        return f'''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
+  <text x="{half_w}" y="165" font-family="Arial, sans-serif" font-size="14" fill="#4338ca" text-anchor="middle" opacity="0">R = Resistance (Ω)</text>
+</svg>''')
+
+_BATTERY_SVG = _minify('''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
   <defs>
     <linearGradient id="batteryGrad" x1="0%" y1="0%" x2="0%" y2="100%">
       <stop offset="0%" style="stop-color:#4CAF50;stop-opacity:1" />
       <stop offset="50%" style="stop-color:#2E7D32;stop-opacity:1" />
       <stop offset="100%" style="stop-color:#1B5E20;stop-opacity:1" />
     </linearGradient>
-    <filter id="shadow">
-      <feDropShadow dx="2" dy="2" stdDeviation="3" flood-opacity="0.3"/>
-    </filter>
+    {shadow_def}
   </defs>
   <!-- Background -->
   <rect width="{width}" height="{height}" fill="#f5f5f5" rx="8"/>
   
   <!-- Text box -->
   <rect x="20" y="20" width="360" height="70" fill="#fff" stroke="#10b981" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="45" font-family="Arial, sans-serif" font-size="18" font-weight="bold" fill="#065f46" text-anchor="middle" opacity="0">Battery Component</text>
-  <text x="{width/2}" y="70" font-family="Arial, sans-serif" font-size="14" fill="#4b5563" text-anchor="middle" opacity="0">Voltage: {voltage}</text>
+  <text x="{half_w}" y="45" font-family="Arial, sans-serif" font-size="18" font-weight="bold" fill="#065f46" text-anchor="middle" opacity="0">Battery Component</text>
+  <text x="{half_w}" y="70" font-family="Arial, sans-serif" font-size="14" fill="#4b5563" text-anchor="middle" opacity="0">Voltage: {voltage}</text>
   
   <!-- Battery diagram -->
-  <g transform="translate({width/2 - 60}, 120)">
+  <g transform="translate({body_x}, 120)">
     <!-- Battery body -->
     <rect x="0" y="0" width="80" height="100" fill="url(#batteryGrad)" stroke="#1B5E20" stroke-width="3" rx="5" opacity="0"/>
     <!-- Positive terminal -->
@@ -112,34 +134,27 @@ class ParametricSVGGenerator:
   
   <!-- Info box -->
   <rect x="20" y="200" width="360" height="35" fill="#d1fae5" stroke="#10b981" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="222" font-family="Arial, sans-serif" font-size="13" fill="#065f46" text-anchor="middle" opacity="0">Provides electrical energy to the circuit</text>
-</svg>'''
-    
-    def _generate_stethoscope(self, params: Dict[str, Any]) -> str:
-        """Generate stethoscope SVG with text box."""
-        width = 450
-        height = 500
-        
-        return f'''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
+  <text x="{half_w}" y="222" font-family="Arial, sans-serif" font-size="13" fill="#065f46" text-anchor="middle" opacity="0">Provides electrical energy to the circuit</text>
+</svg>''')
+
+_STETHOSCOPE_SVG = _minify('''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
   <defs>
     <linearGradient id="tubeGrad" x1="0%" y1="0%" x2="100%" y2="0%">
       <stop offset="0%" style="stop-color:#4169E1;stop-opacity:1" />
       <stop offset="100%" style="stop-color:#1E90FF;stop-opacity:1" />
     </linearGradient>
-    <filter id="shadow">
-      <feDropShadow dx="2" dy="2" stdDeviation="3" flood-opacity="0.3"/>
-    </filter>
+    {shadow_def}
   </defs>
   <!-- Background -->
   <rect width="{width}" height="{height}" fill="#f5f5f5" rx="8"/>
   
   <!-- Title box -->
   <rect x="20" y="20" width="410" height="60" fill="#fff" stroke="#6366f1" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="45" font-family="Arial, sans-serif" font-size="18" font-weight="bold" fill="#4338ca" text-anchor="middle" opacity="0">Stethoscope</text>
-  <text x="{width/2}" y="65" font-family="Arial, sans-serif" font-size="14" fill="#6b7280" text-anchor="middle" opacity="0">Medical diagnostic instrument</text>
+  <text x="{half_w}" y="45" font-family="Arial, sans-serif" font-size="18" font-weight="bold" fill="#4338ca" text-anchor="middle" opacity="0">Stethoscope</text>
+  <text x="{half_w}" y="65" font-family="Arial, sans-serif" font-size="14" fill="#6b7280" text-anchor="middle" opacity="0">Medical diagnostic instrument</text>
   
   <!-- Stethoscope diagram -->
-  <g transform="translate({width/2 - 75}, 100)">
+  <g transform="translate({body_x}, 100)">
     <!-- Chest piece -->
     <circle cx="75" cy="0" r="35" fill="#C0C0C0" stroke="#808080" stroke-width="3" opacity="0"/>
     <circle cx="75" cy="0" r="25" fill="#E0E0E0" stroke="#A0A0A0" stroke-width="2" opacity="0"/>
@@ -170,60 +185,136 @@ class ParametricSVGGenerator:
   
   <!-- Usage box -->
   <rect x="20" y="430" width="410" height="55" fill="#dbeafe" stroke="#3b82f6" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="455" font-family="Arial, sans-serif" font-size="13" fill="#1e40af" text-anchor="middle" opacity="0">Used to listen to internal body sounds</text>
-  <text x="{width/2}" y="475" font-family="Arial, sans-serif" font-size="12" fill="#4b5563" text-anchor="middle" opacity="0">Heart, lungs, and blood flow</text>
-</svg>'''
-    
-    def _generate_graph(self, params: Dict[str, Any]) -> str:
-        """Generate graph/chart SVG with text box."""
-        width = 500
-        height = 400
-        data_points = params.get("points", [10, 30, 20, 40, 35, 50, 45])
-        graph_title = params.get("title", "Data Visualization")
-        
-        max_val = max(data_points) if data_points else 50
-        normalized = [int((p / max_val) * 200) for p in data_points]
-        
-        path_d = f"M 80 {height - 80 - normalized[0]}"
-        for i, val in enumerate(normalized[1:], 1):
-            x = 80 + (i * 60)
-            y = height - 80 - val
-            path_d += f" L {x} {y}"
-        
-        return f'''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
+  <text x="{half_w}" y="455" font-family="Arial, sans-serif" font-size="13" fill="#1e40af" text-anchor="middle" opacity="0">Used to listen to internal body sounds</text>
+  <text x="{half_w}" y="475" font-family="Arial, sans-serif" font-size="12" fill="#4b5563" text-anchor="middle" opacity="0">Heart, lungs, and blood flow</text>
+</svg>''')
+
+_GRAPH_SVG = _minify('''<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">
   <defs>
     <pattern id="grid" width="60" height="60" patternUnits="userSpaceOnUse">
       <path d="M 60 0 L 0 0 0 60" fill="none" stroke="#e0e0e0" stroke-width="1"/>
     </pattern>
-    <filter id="shadow">
-      <feDropShadow dx="2" dy="2" stdDeviation="3" flood-opacity="0.3"/>
-    </filter>
+    {shadow_def}
   </defs>
   <!-- Background -->
   <rect width="{width}" height="{height}" fill="#f5f5f5" rx="8"/>
   
   <!-- Title box -->
   <rect x="20" y="20" width="460" height="50" fill="#fff" stroke="#3b82f6" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="{width/2}" y="45" font-family="Arial, sans-serif" font-size="18" font-weight="bold" fill="#1e40af" text-anchor="middle" opacity="0">{graph_title}</text>
-  <text x="{width/2}" y="65" font-family="Arial, sans-serif" font-size="12" fill="#6b7280" text-anchor="middle" opacity="0">Visual representation of data over time</text>
+  <text x="{half_w}" y="45" font-family="Arial, sans-serif" font-size="18" font-weight="bold" fill="#1e40af" text-anchor="middle" opacity="0">{graph_title}</text>
+  <text x="{half_w}" y="65" font-family="Arial, sans-serif" font-size="12" fill="#6b7280" text-anchor="middle" opacity="0">Visual representation of data over time</text>
   
   <!-- Graph area -->
   <g transform="translate(0, 90)">
     <rect x="60" y="0" width="420" height="250" fill="url(#grid)" opacity="0"/>
     <!-- Axes -->
-    <line x1="80" y1="250" x2="460" y2="250" stroke="#333" stroke-width="3" opacity="0"/>
-    <line x1="80" y1="20" x2="80" y2="250" stroke="#333" stroke-width="3" opacity="0"/>
+    <path d="M 80 250 L 460 250 M 80 20 L 80 250" fill="none" stroke="#333" stroke-width="3"/>
     <!-- Data line -->
     <path d="{path_d}" fill="none" stroke="#3b82f6" stroke-width="4" stroke-linecap="round" stroke-linejoin="round" opacity="0"/>
     <!-- Data points -->
-    {''.join([f'<circle cx="{80 + i * 60}" cy="{250 - normalized[i]}" r="6" fill="#3b82f6" opacity="0"/>' for i in range(len(normalized))])}
+    {circles}
     <!-- Labels -->
-    <text x="{width/2}" y="290" font-family="Arial, sans-serif" font-size="14" font-weight="bold" fill="#374151" text-anchor="middle" opacity="0">Time</text>
+    <text x="{half_w}" y="290" font-family="Arial, sans-serif" font-size="14" font-weight="bold" fill="#374151" text-anchor="middle" opacity="0">Time</text>
     <text x="30" y="145" font-family="Arial, sans-serif" font-size="14" font-weight="bold" fill="#374151" text-anchor="middle" transform="rotate(-90 30 145)" opacity="0">Value</text>
   </g>
   
   <!-- Stats box -->
   <rect x="20" y="340" width="460" height="45" fill="#dbeafe" stroke="#3b82f6" stroke-width="2" rx="6" filter="url(#shadow)" opacity="0"/>
-  <text x="250" y="360" font-family="Arial, sans-serif" font-size="12" fill="#1e40af" text-anchor="middle" opacity="0">Max: {max(data_points) if data_points else 0} | Min: {min(data_points) if data_points else 0} | Avg: {int(sum(data_points)/len(data_points)) if data_points else 0}</text>
-</svg>'''
+  <text x="250" y="360" font-family="Arial, sans-serif" font-size="12" fill="#1e40af" text-anchor="middle" opacity="0">Max: {max_point} | Min: {min_point} | Avg: {avg_point}</text>
+</svg>''')
+
+# Fixed canvas sizes, with the derived offsets the templates use.
+_RESISTOR_LAYOUT = {"width": 400, "height": 200, "half_w": 400 / 2, "shadow_def": _SHADOW_DEF}
+_BATTERY_LAYOUT = {"width": 400, "height": 250, "half_w": 400 / 2, "body_x": 400 / 2 - 60, "shadow_def": _SHADOW_DEF}
+_GRAPH_LAYOUT = {"width": 500, "height": 400, "half_w": 500 / 2, "shadow_def": _SHADOW_DEF}
+# The stethoscope takes no params, so it's rendered once.
+_STETHOSCOPE = _STETHOSCOPE_SVG.format_map({
+    "width": 450, "height": 500, "half_w": 450 / 2, "body_x": 450 / 2 - 75, "shadow_def": _SHADOW_DEF
+})
+
+
+class ParametricSVGGenerator:
+    """Generate parametric SVG primitives."""
+    
+    _DISPATCH: Dict[str, Any]  # filled in below the class
+    
+    def generate(self, primitive_id: str, params: Dict[str, Any] = None) -> str:
+        """Generate SVG for a primitive type (memoized on primitive_id and params)."""
+        return self.generate_with_digest(primitive_id, params)[0]
+    
+    def generate_with_digest(self, primitive_id: str, params: Dict[str, Any] = None) -> Tuple[str, str]:
+        """Like generate(), plus a short content hash of the SVG for ETags / cache-busting URLs."""
+        params = params or {}
+        try:
+            key = (primitive_id, _freeze(params))
+            with _SVG_CACHE_LOCK:
+                entry = _SVG_CACHE.get(key)
+                if entry is not None:
+                    _SVG_CACHE.move_to_end(key)
+        except TypeError:  # unhashable param values; just render
+            return self._render_entry(primitive_id, params)
+        if entry is None:
+            entry = self._render_entry(primitive_id, params)
+            with _SVG_CACHE_LOCK:
+                _SVG_CACHE[key] = entry
+                if len(_SVG_CACHE) > _SVG_CACHE_SIZE:
+                    _SVG_CACHE.popitem(last=False)
+        return entry
+    
+    def _render_entry(self, primitive_id: str, params: Dict[str, Any]) -> Tuple[str, str]:
+        svg = self._render(primitive_id, params)
+        return svg, hashlib.blake2b(svg.encode("utf-8"), digest_size=8).hexdigest()
+    
+    def _render(self, primitive_id: str, params: Dict[str, Any]) -> str:
+        handler = self._DISPATCH.get(primitive_id, ParametricSVGGenerator._generate_graph)  # graph is the default
+        return handler(self, params)
+    
+    def _generate_resistor(self, params: Dict[str, Any]) -> str:
+        """Generate resistor SVG with text box."""
+        return _RESISTOR_SVG.format_map({**_RESISTOR_LAYOUT, "value": params.get("value", "10kΩ")})
+    
+    def _generate_battery(self, params: Dict[str, Any]) -> str:
+        """Generate battery SVG with text box."""
+        return _BATTERY_SVG.format_map({**_BATTERY_LAYOUT, "voltage": params.get("voltage", "9V")})
+    
+    def _generate_stethoscope(self, params: Dict[str, Any]) -> str:
+        """Generate stethoscope SVG with text box."""
+        return _STETHOSCOPE
+    
+    def _generate_graph(self, params: Dict[str, Any]) -> str:
+        """Generate graph/chart SVG with text box."""
+        height = _GRAPH_LAYOUT["height"]
+        data_points = params.get("points", [10, 30, 20, 40, 35, 50, 45])
+        graph_title = params.get("title", "Data Visualization")
+        
+        max_point = max(data_points) if data_points else 0
+        max_val = (max_point if data_points else 50) or 1
+        
+        # One pass over the scaled points builds both the line commands and the point markers.
+        path_parts = []
+        circles = []
+        for i, value in enumerate(_scaled_points(data_points, max_val)):
+            x = 80 + i * 60
+            path_parts.append("L %d %d" % (x, height - 80 - value))
+            circles.append('<circle cx="%d" cy="%d" r="6" fill="#3b82f6" opacity="0"/>' % (x, 250 - value))
+        if path_parts:
+            path_parts[0] = "M" + path_parts[0][1:]
+        
+        return _GRAPH_SVG.format_map({
+            **_GRAPH_LAYOUT,
+            "graph_title": graph_title,
+            "path_d": " ".join(path_parts),
+            "circles": "".join(circles),
+            "max_point": max_point,
+            "min_point": min(data_points) if data_points else 0,
+            "avg_point": int(sum(data_points)/len(data_points)) if data_points else 0
+        })
+
 
+# primitive_id -> generator method; register new primitives here.
+ParametricSVGGenerator._DISPATCH = {
+    "resistor": ParametricSVGGenerator._generate_resistor,
+    "battery": ParametricSVGGenerator._generate_battery,
+    "stethoscope": ParametricSVGGenerator._generate_stethoscope,
+    "graph": ParametricSVGGenerator._generate_graph,
+}
@@ -4,27 +4,20 @@ Gemini LLM client for extracting lesson structure from prompts.
 import os
 import json
 import re
-from typing import Dict, Any, Optional
+import importlib.util
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Any, Optional
 
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+    _dumps = json.dumps
 
-class GeminiClient:
-    """Client for Google Gemini API."""
-    
-    def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
-    
-    def extract_lesson_structure(self, prompt: str) -> Dict[str, Any]:
-        """
-        Extract structured lesson data from user prompt.
-        Returns dict with: topic, subtopic, intent, audience, suggested_steps, primitives, learning_objectives
-        """
-        if not self.api_key:
-            print("GEMINI_API_KEY not set, using fallback extraction")
-            return self._fallback_extraction(prompt)
-        
-        try:
-            system_prompt = """You are an educational content generator. Extract structured lesson information from the user's prompt.
+# Instructions sent ahead of every user prompt.
+_SYSTEM_PROMPT = """You are an educational content generator. Extract structured lesson information from the user's prompt.
 
 Return ONLY valid JSON (no markdown, no code blocks) with this exact structure:
 {
@@ -58,154 +51,282 @@ IMPORTANT:
 - For primitives, choose from: resistor, battery, stethoscope, graph
 - Add params if needed (e.g., {"value": "10k"} for resistor, {"voltage": "9V"} for battery)
 - Distribute primitives across steps (each step should have at least one)"""
-            
-            full_prompt = f"{system_prompt}\n\nUser prompt: {prompt}\n\nJSON:"
-            
-            response = self._call_gemini(full_prompt)
+_SYSTEM_PROMPT_PREFIX = _SYSTEM_PROMPT + "\n\nUser prompt: "
+_SYSTEM_PROMPT_SUFFIX = "\n\nJSON:"
+
+# Fallback topic keywords, matched as substrings of the lowercased prompt in one pass. Groups are
+# listed in priority order: a prompt mentioning a circuit and a battery is a circuit lesson.
+_KEYWORD_GROUPS = {
+    "circuit": ("resistor", "ohm", "circuit"),
+    "power": ("battery", "voltage", "power"),
+    "medical": ("stethoscope", "medical", "heart"),
+}
+_KEYWORD_GROUP = {kw: group for group, kws in _KEYWORD_GROUPS.items() for kw in kws}
+# Matched against prompt.lower() rather than with IGNORECASE: Unicode case folding lets
+# IGNORECASE match text (e.g. "reſiſtor") whose .lower() isn't a key.
+_KEYWORD_RE = re.compile("|".join(_KEYWORD_GROUP))
+_OHM_KEYWORDS = frozenset(("ohm", "resistor"))
+
+
+def _extract_json_block(text: str) -> Optional[str]:
+    """First balanced {...} block in text, found with one linear scan that skips braces in strings."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    
+    depth = 0
+    in_str = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+@lru_cache(maxsize=128)
+def _fallback_structure(topic: str, group: str, is_ohm: bool):
+    """
+    Canned lesson structure for a topic and keyword group.
+    Cached as JSON so every caller gets a fresh, mutable copy.
+    """
+    primitives = []
+    if group == "circuit":
+        primitives.append({"primitive_id": "resistor", "params": {"value": "10kΩ"}})
+        primitives.append({"primitive_id": "battery", "params": {"voltage": "9V"}})
+        primitives.append({"primitive_id": "graph", "params": {}})
+    elif group == "power":
+        primitives.append({"primitive_id": "battery", "params": {"voltage": "12V"}})
+        primitives.append({"primitive_id": "graph", "params": {}})
+    elif group == "medical":
+        primitives.append({"primitive_id": "stethoscope", "params": {}})
+        primitives.append({"primitive_id": "graph", "params": {}})
+    else:
+        primitives.append({"primitive_id": "graph", "params": {}})
+        primitives.append({"primitive_id": "graph", "params": {"points": [10, 30, 20, 40, 35, 50, 45, 60]}})
+    
+    if is_ohm:
+        steps = [
+            {
+                "title": "Introduction to Ohm's Law",
+                "description": "Ohm's Law is a fundamental principle in electrical engineering that describes the relationship between voltage, current, and resistance in an electrical circuit. It states that the current through a conductor between two points is directly proportional to the voltage across the two points and inversely proportional to the resistance between them.",
+                "key_points": [
+                    "Ohm's Law: V = I × R",
+                    "Voltage (V) is measured in volts",
+                    "Current (I) is measured in amperes",
+                    "Resistance (R) is measured in ohms"
+                ],
+                "formula": "V = I × R",
+                "duration_seconds": 20
+            },
+            {
+                "title": "Understanding Resistance",
+                "description": "Resistance is the opposition to the flow of electric current. In a resistor, resistance is determined by the material, length, and cross-sectional area. Color-coded bands on resistors indicate their resistance value, making it easy to identify components in circuits.",
+                "key_points": [
+                    "Resistance opposes current flow",
+                    "Measured in ohms (Ω)",
+                    "Color bands indicate resistance value",
+                    "Higher resistance = less current flow"
+                ],
+                "duration_seconds": 20
+            },
+            {
+                "title": "Circuit Analysis",
+                "description": "When analyzing circuits with Ohm's Law, we can calculate any one of the three variables (voltage, current, or resistance) if we know the other two. This makes circuit design and troubleshooting much easier. Let's see how voltage, current, and resistance interact in a simple circuit.",
+                "key_points": [
+                    "Calculate voltage: V = I × R",
+                    "Calculate current: I = V / R",
+                    "Calculate resistance: R = V / I",
+                    "All three are interconnected"
+                ],
+                "formula": "I = V / R",
+                "duration_seconds": 25
+            }
+        ]
+    else:
+        steps = [
+            {
+                "title": "Introduction",
+                "description": f"Welcome to this lesson about {topic[:50]}. We'll explore the fundamental concepts and build a solid understanding step by step. This topic is important because it forms the foundation for deeper learning.",
+                "key_points": [
+                    "Understanding the basics",
+                    "Key terminology",
+                    "Real-world applications",
+                    "Why this matters"
+                ],
+                "duration_seconds": 20
+            },
+            {
+                "title": "Core Concepts",
+                "description": "Let's dive into the core concepts. We'll break down complex ideas into manageable pieces, using visual aids and examples to make everything clear. Each concept builds on the previous one, creating a comprehensive understanding.",
+                "key_points": [
+                    "Breaking down complex ideas",
+                    "Visual learning aids",
+                    "Step-by-step progression",
+                    "Building understanding"
+                ],
+                "duration_seconds": 25
+            },
+            {
+                "title": "Practical Application",
+                "description": "Now that we understand the theory, let's see how these concepts apply in real-world scenarios. Practical examples help solidify our understanding and show the relevance of what we've learned.",
+                "key_points": [
+                    "Real-world examples",
+                    "Practical applications",
+                    "Connecting theory to practice",
+                    "Hands-on learning"
+                ],
+                "duration_seconds": 25
+            }
+        ]
+    
+    return _dumps({
+        "topic": topic,
+        "subtopic": "Introduction",
+        "intent": "educational",
+        "audience": "beginner",
+        "suggested_steps": steps,
+        "primitives": primitives,
+        "learning_objectives": ["Understand the core concepts", "Apply knowledge practically", "Build a solid foundation"]
+    })
+
+
+def _request_payload(prompt: str) -> Dict[str, Any]:
+    return {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }]
+    }
+
+
+def _response_text(data: Dict[str, Any]) -> str:
+    """Text of the first candidate in a generateContent response."""
+    if "candidates" in data and len(data["candidates"]) > 0:
+        content = data["candidates"][0].get("content", {})
+        parts = content.get("parts", [])
+        if parts:
+            return parts[0].get("text", "")
+    
+    raise ValueError("No content in Gemini response")
+
+
+class GeminiClient:
+    """Client for Google Gemini API."""
+    
+    def __init__(self):
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+        self._session = None  # requests.Session, created on first call
+        self._aclient = None  # httpx.AsyncClient, created on first async call
+    
+    def extract_lesson_structure(self, prompt: str) -> Dict[str, Any]:
+        """
+        Extract structured lesson data from user prompt.
+        Returns dict with: topic, subtopic, intent, audience, suggested_steps, primitives, learning_objectives
+        """
+        async def call(full_prompt: str) -> str:
+            return self._call_gemini(full_prompt)
+        
+        # call never suspends, so the coroutine runs to completion on its first step.
+        extraction = self._extract(prompt, call)
+        try:
+            extraction.send(None)
+        except StopIteration as done:
+            return done.value
+        extraction.close()
+        raise RuntimeError("lesson extraction suspended without an event loop")
+    
+    async def extract_lesson_structure_async(self, prompt: str) -> Dict[str, Any]:
+        """extract_lesson_structure without blocking the event loop while Gemini responds."""
+        return await self._extract(prompt, self._call_gemini_async)
+    
+    async def _extract(self, prompt: str, call: Callable[[str], Awaitable[str]]) -> Dict[str, Any]:
+        """Ask Gemini for the lesson structure through call, falling back to keyword extraction."""
+        if not self.api_key:
+            print("GEMINI_API_KEY not set, using fallback extraction")
+            return self._fallback_extraction(prompt)
+        
+        try:
+            response = await call(_SYSTEM_PROMPT_PREFIX + prompt + _SYSTEM_PROMPT_SUFFIX)
             return self._parse_json_response(response)
         except Exception as e:
             print(f"Gemini API call failed: {e}")
             return self._fallback_extraction(prompt)
     
+    async def aclose(self) -> None:
+        """Close the async HTTP client; its connections belong to the running event loop."""
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+    
     def _call_gemini(self, prompt: str) -> str:
         """Call Gemini API."""
-        try:
-            import requests
-        except ImportError:
-            raise ImportError("requests package is required. Install it with: pip install requests")
-        
-        url = f"{self.base_url}?key={self.api_key}"
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }]
-        }
+        if self._session is None:
+            try:
+                import requests
+                from requests.adapters import HTTPAdapter
+            except ImportError:
+                raise ImportError("requests package is required. Install it with: pip install requests")
+            # One pooled session, so TCP/TLS connections are reused across calls.
+            session = requests.Session()
+            # The key goes in a header so it stays out of URLs in error messages.
+            session.headers.update({"Content-Type": "application/json", "x-goog-api-key": self.api_key})
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+            self._session = session
         
-        response = requests.post(url, json=payload, timeout=30)
+        response = self._session.post(self.base_url, json=_request_payload(prompt), timeout=30)
         response.raise_for_status()
+        return _response_text(_loads(response.content))
+    
+    async def _call_gemini_async(self, prompt: str) -> str:
+        """Call Gemini API over a pooled httpx.AsyncClient."""
+        if self._aclient is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError("httpx package is required for async calls. Install it with: pip install httpx")
+            # HTTP/2 needs the optional h2 package; without it httpx uses HTTP/1.1.
+            self._aclient = httpx.AsyncClient(
+                timeout=30,
+                http2=importlib.util.find_spec("h2") is not None,
+                headers={"Content-Type": "application/json"},
+                limits=httpx.Limits(max_connections=8)
+            )
         
-        data = response.json()
-        if "candidates" in data and len(data["candidates"]) > 0:
-            content = data["candidates"][0].get("content", {})
-            parts = content.get("parts", [])
-            if parts:
-                return parts[0].get("text", "")
-        
-        raise ValueError("No content in Gemini response")
+        # The key goes in a header so it stays out of URLs in error messages.
+        response = await self._aclient.post(
+            self.base_url,
+            content=_dumps(_request_payload(prompt)),
+            headers={"x-goog-api-key": self.api_key}
+        )
+        response.raise_for_status()
+        return _response_text(_loads(response.content))
     
     def _parse_json_response(self, text: str) -> Dict[str, Any]:
         """Extract JSON from Gemini response text."""
-        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            return json.loads(json_str)
-        
+        json_str = _extract_json_block(text)
         try:
-            return json.loads(text)
-        except:
+            return _loads(json_str if json_str is not None else text)
+        except ValueError:
             raise ValueError("Could not parse JSON from response")
     
     def _fallback_extraction(self, prompt: str) -> Dict[str, Any]:
         """Fallback extraction when Gemini is unavailable."""
-        prompt_lower = prompt.lower()
-        
-        primitives = []
-        if "resistor" in prompt_lower or "ohm" in prompt_lower or "circuit" in prompt_lower:
-            primitives.append({"primitive_id": "resistor", "params": {"value": "10kΩ"}})
-            primitives.append({"primitive_id": "battery", "params": {"voltage": "9V"}})
-            primitives.append({"primitive_id": "graph", "params": {}})
-        elif "battery" in prompt_lower or "voltage" in prompt_lower or "power" in prompt_lower:
-            primitives.append({"primitive_id": "battery", "params": {"voltage": "12V"}})
-            primitives.append({"primitive_id": "graph", "params": {}})
-        elif "stethoscope" in prompt_lower or "medical" in prompt_lower or "heart" in prompt_lower:
-            primitives.append({"primitive_id": "stethoscope", "params": {}})
-            primitives.append({"primitive_id": "graph", "params": {}})
-        else:
-            primitives.append({"primitive_id": "graph", "params": {}})
-            primitives.append({"primitive_id": "graph", "params": {"points": [10, 30, 20, 40, 35, 50, 45, 60]}})
-        
-        if "ohm" in prompt_lower or "resistor" in prompt_lower:
-            steps = [
-                {
-                    "title": "Introduction to Ohm's Law",
-                    "description": "Ohm's Law is a fundamental principle in electrical engineering that describes the relationship between voltage, current, and resistance in an electrical circuit. It states that the current through a conductor between two points is directly proportional to the voltage across the two points and inversely proportional to the resistance between them.",
-                    "key_points": [
-                        "Ohm's Law: V = I × R",
-                        "Voltage (V) is measured in volts",
-                        "Current (I) is measured in amperes",
-                        "Resistance (R) is measured in ohms"
-                    ],
-                    "formula": "V = I × R",
-                    "duration_seconds": 20
-                },
-                {
-                    "title": "Understanding Resistance",
-                    "description": "Resistance is the opposition to the flow of electric current. In a resistor, resistance is determined by the material, length, and cross-sectional area. Color-coded bands on resistors indicate their resistance value, making it easy to identify components in circuits.",
-                    "key_points": [
-                        "Resistance opposes current flow",
-                        "Measured in ohms (Ω)",
-                        "Color bands indicate resistance value",
-                        "Higher resistance = less current flow"
-                    ],
-                    "duration_seconds": 20
-                },
-                {
-                    "title": "Circuit Analysis",
-                    "description": "When analyzing circuits with Ohm's Law, we can calculate any one of the three variables (voltage, current, or resistance) if we know the other two. This makes circuit design and troubleshooting much easier. Let's see how voltage, current, and resistance interact in a simple circuit.",
-                    "key_points": [
-                        "Calculate voltage: V = I × R",
-                        "Calculate current: I = V / R",
-                        "Calculate resistance: R = V / I",
-                        "All three are interconnected"
-                    ],
-                    "formula": "I = V / R",
-                    "duration_seconds": 25
-                }
-            ]
-        else:
-            steps = [
-                {
-                    "title": "Introduction",
-                    "description": f"Welcome to this lesson about {prompt[:50]}. We'll explore the fundamental concepts and build a solid understanding step by step. This topic is important because it forms the foundation for deeper learning.",
-                    "key_points": [
-                        "Understanding the basics",
-                        "Key terminology",
-                        "Real-world applications",
-                        "Why this matters"
-                    ],
-                    "duration_seconds": 20
-                },
-                {
-                    "title": "Core Concepts",
-                    "description": "Let's dive into the core concepts. We'll break down complex ideas into manageable pieces, using visual aids and examples to make everything clear. Each concept builds on the previous one, creating a comprehensive understanding.",
-                    "key_points": [
-                        "Breaking down complex ideas",
-                        "Visual learning aids",
-                        "Step-by-step progression",
-                        "Building understanding"
-                    ],
-                    "duration_seconds": 25
-                },
-                {
-                    "title": "Practical Application",
-                    "description": "Now that we understand the theory, let's see how these concepts apply in real-world scenarios. Practical examples help solidify our understanding and show the relevance of what we've learned.",
-                    "key_points": [
-                        "Real-world examples",
-                        "Practical applications",
-                        "Connecting theory to practice",
-                        "Hands-on learning"
-                    ],
-                    "duration_seconds": 25
-                }
-            ]
-        
-        return {
-            "topic": prompt[:60] if len(prompt) > 60 else prompt,
-            "subtopic": "Introduction",
-            "intent": "educational",
-            "audience": "beginner",
-            "suggested_steps": steps,
-            "primitives": primitives,
-            "learning_objectives": ["Understand the core concepts", "Apply knowledge practically", "Build a solid foundation"]
-        }
-
+        found = set(_KEYWORD_RE.findall(prompt.lower()))
+        groups = {_KEYWORD_GROUP[kw] for kw in found}
+        group = next((g for g in _KEYWORD_GROUPS if g in groups), "default")
+        # The structure only depends on the topic text and the keyword matches.
+        return _loads(_fallback_structure(prompt[:60], group, not _OHM_KEYWORDS.isdisjoint(found)))
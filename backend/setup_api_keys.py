@@ -23,10 +23,11 @@ def setup_api_keys():
             return
         
         with open(env_file, 'r') as f:
-            for line in f:
-                if '=' in line and not line.strip().startswith('#'):
-                    key, value = line.strip().split('=', 1)
-                    existing_keys[key] = value
+            existing_keys = dict(
+                line.strip().split('=', 1)
+                for line in f
+                if '=' in line and not line.strip().startswith('#')
+            )
     
     print()
     print("1. Google Gemini API Key")
@@ -57,15 +58,14 @@ def setup_api_keys():
     print()
     print("Writing to .env file...")
     
-    lines = []
+    content = ""
     if gemini_key:
-        lines.append(f"GEMINI_API_KEY={gemini_key}\n")
+        content += f"GEMINI_API_KEY={gemini_key}\n"
     if hf_token:
-        lines.append(f"HF_API_TOKEN={hf_token}\n")
+        content += f"HF_API_TOKEN={hf_token}\n"
     
-    if lines:
-        with open(env_file, 'w') as f:
-            f.writelines(lines)
+    if content:
+        env_file.write_text(content)
         print("✅ API keys saved to .env file")
     else:
         print("⏭️  No API keys provided (system will use fallbacks)")
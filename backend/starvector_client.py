@@ -2,7 +2,12 @@
 Hugging Face StarVector client for SVG generation.
 """
 import os
+import asyncio
+import random
 import re
+import time
+from functools import lru_cache
+from io import BytesIO
 from typing import Optional
 
 try:
@@ -11,6 +16,89 @@ except ImportError:
     etree = None  # type: ignore
     print("Warning: lxml not installed. SVG validation will be limited. Install with: pip install lxml")
 
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None  # type: ignore
+    print("Warning: requests not installed. StarVector generation is disabled. Install with: pip install requests")
+
+try:
+    import svgelements
+except ImportError:
+    svgelements = None  # type: ignore
+    print("Warning: svgelements not installed. Path lengths will be measured in the browser. Install with: pip install svgelements")
+
+_SVG_BLOCK_BYTES_RE = re.compile(rb'<svg[^>]*>.*?</svg>', re.DOTALL | re.IGNORECASE)  # streamed response bodies
+_SVG_CLOSE_BYTES_RE = re.compile(rb'</svg>', re.IGNORECASE)
+_SVG_OPEN_RE = re.compile(r'<svg[^>]*>', re.IGNORECASE)
+_SCRIPT_RE = re.compile(r'<script[^>]*>.*?</script>', re.DOTALL | re.IGNORECASE)
+_FOREIGN_OBJECT_RE = re.compile(r'<foreignObject[^>]*>.*?</foreignObject>', re.DOTALL | re.IGNORECASE)
+_IMAGE_RE = re.compile(r'<image[^>]*>', re.IGNORECASE)
+_EVENT_ATTR_RE = re.compile(r'\s*on\w+\s*=\s*["\'][^"\']*["\']', re.IGNORECASE)
+_SVG_TAG_RE = re.compile(r'<svg\b([^>]*)>', re.IGNORECASE)
+_DIM_RE = re.compile(r'(?<![\w-])(width|height)\s*=\s*["\']?(\d+)', re.IGNORECASE)
+_PATH_TAG_RE = re.compile(r'<path\b[^>]*>', re.IGNORECASE)
+_PATH_D_RE = re.compile(r'\sd\s*=\s*(["\'])(.*?)\1', re.DOTALL)
+
+# Statuses worth retrying (rate limit / gateway hiccups); any other HTTP error fails fast.
+_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+_MAX_RETRY_DELAY = 30
+
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying after error, or None if retrying won't help."""
+    if isinstance(error, ImportError):
+        return None
+    response = getattr(error, "response", None)  # set on requests' HTTPError
+    if response is not None:
+        if response.status_code not in _RETRY_STATUSES:
+            return None
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(_MAX_RETRY_DELAY, int(retry_after))
+    # Exponential backoff with jitter, so clients throttled together don't retry in lockstep.
+    return min(_MAX_RETRY_DELAY, (2 ** attempt) * (1 + random.random() * 0.5))
+
+
+def _request_payload(prompt: str) -> dict:
+    """Inference API request body for a prompt."""
+    return {
+        "inputs": prompt,
+        "parameters": {
+            "max_new_tokens": 2048
+        }
+    }
+
+
+class _SVGStreamScanner:
+    """Accumulates a streamed response body until it holds a complete <svg> block."""
+    
+    def __init__(self):
+        self._buffer = bytearray()
+    
+    def feed(self, chunk: bytes) -> Optional[str]:
+        """Add a chunk; returns the SVG once its closing tag has arrived."""
+        # Only the new bytes (plus a tag's worth of overlap) can hold the first closing tag.
+        start = max(0, len(self._buffer) - len(b"</svg>") + 1)
+        self._buffer += chunk
+        if not _SVG_CLOSE_BYTES_RE.search(self._buffer, start):
+            return None
+        svg_match = _SVG_BLOCK_BYTES_RE.search(self._buffer)
+        return svg_match.group(0).decode("utf-8", errors="replace") if svg_match else None
+
+
+@lru_cache(maxsize=1024)
+def _extract_dimensions(svg_content: str) -> tuple[int, int]:
+    """Memoized width/height lookup; the fallback generator repeats identical SVGs."""
+    # Both come from the root <svg> tag's attributes, read in one pass.
+    tag_match = _SVG_TAG_RE.search(svg_content)
+    dims: dict = {}
+    if tag_match:
+        for name, value in _DIM_RE.findall(tag_match.group(1)):
+            dims.setdefault(name.lower(), int(value))
+    return dims.get("width", 400), dims.get("height", 300)
+
 
 class StarVectorClient:
     """Client for Hugging Face StarVector Inference API."""
@@ -19,6 +107,8 @@ class StarVectorClient:
         self.api_token = os.getenv("HF_API_TOKEN")
 
         self.api_url = "https://api-inference.huggingface.co/models/starvector/starvector-1b-im2svg"
+        self._session = None  # requests.Session, created on first call
+        self._aclient = None  # httpx.AsyncClient, created on first async call
     
     def generate_svg(self, prompt: str, max_retries: int = 2) -> Optional[str]:
         """
@@ -28,86 +118,180 @@ class StarVectorClient:
         if not self.api_token:
             print("HF_API_TOKEN not set, skipping StarVector generation")
             return None
+        if requests is None:
+            print("requests not installed, skipping StarVector generation")
+            return None
         
         for attempt in range(max_retries + 1):
             try:
-                try:
-                    import requests
-                except ImportError:
-                    raise ImportError("requests package is required. Install it with: pip install requests")
-
-                headers = {"Authorization": f"Bearer {self.api_token}"}
-                payload = {
-                    "inputs": prompt,
-                    "parameters": {
-                        "max_new_tokens": 2048
-                    }
-                }
-
-                response = requests.post(
+                # Streamed, so reading stops (and the connection is dropped) as soon as the SVG closes,
+                # and the body is matched as raw bytes rather than decoded whole.
+                with self._get_session().post(
                     self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=60
-                )
-                response.raise_for_status()
-
-                svg = self._extract_svg_from_response(response.text)
-                return svg
+                    json=_request_payload(prompt),
+                    timeout=60,
+                    stream=True
+                ) as response:
+                    response.raise_for_status()
+                    scanner = _SVGStreamScanner()
+                    # chunk_size=None yields chunks as they arrive instead of waiting to fill a buffer.
+                    for chunk in response.iter_content(chunk_size=None):
+                        svg = scanner.feed(chunk)
+                        if svg is not None:
+                            return svg
+                return None
 
             except Exception as e:
-                if attempt < max_retries:
-                    import time
-                    time.sleep(2 ** attempt)
+                delay = _retry_delay(e, attempt)
+                if delay is not None and attempt < max_retries:
+                    time.sleep(delay)
                     continue
-                print(f"StarVector generation failed after {max_retries + 1} attempts: {e}")
+                print(f"StarVector generation failed after {attempt + 1} attempts: {e}")
                 return None
         
         return None
     
-    def _extract_svg_from_response(self, response_text: str) -> Optional[str]:
-        """Extract SVG block from API response."""
-        svg_match = re.search(
-            r'<svg[^>]*>.*?</svg>',
-            response_text,
-            re.DOTALL | re.IGNORECASE
-        )
-        if svg_match:
-            return svg_match.group(0)
+    async def generate_svg_async(self, prompt: str, max_retries: int = 2) -> Optional[str]:
+        """generate_svg without blocking the event loop while StarVector responds."""
+        if not self.api_token:
+            print("HF_API_TOKEN not set, skipping StarVector generation")
+            return None
+        
+        for attempt in range(max_retries + 1):
+            try:
+                async with self._get_aclient().stream("POST", self.api_url, json=_request_payload(prompt)) as response:
+                    response.raise_for_status()
+                    scanner = _SVGStreamScanner()
+                    async for chunk in response.aiter_bytes():
+                        svg = scanner.feed(chunk)
+                        if svg is not None:
+                            return svg
+                return None
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is not None and attempt < max_retries:
+                    await asyncio.sleep(delay)
+                    continue
+                print(f"StarVector generation failed after {attempt + 1} attempts: {e}")
+                return None
+        
         return None
     
+    def _get_aclient(self):
+        """Pooled httpx.AsyncClient; at most 10 StarVector requests are in flight at once."""
+        if self._aclient is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError("httpx package is required for async calls. Install it with: pip install httpx")
+            self._aclient = httpx.AsyncClient(
+                timeout=60,
+                headers={"Authorization": f"Bearer {self.api_token}"},
+                limits=httpx.Limits(max_connections=10)
+            )
+        return self._aclient
+    
+    async def aclose(self) -> None:
+        """Close the async HTTP client; its connections belong to the running event loop."""
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+    
+    def _get_session(self):
+        """Pooled requests.Session, so TCP/TLS connections are reused across calls and retries."""
+        if self._session is None:
+            session = requests.Session()
+            session.headers.update({"Authorization": f"Bearer {self.api_token}"})
+            # Retries are handled by generate_svg's own loop.
+            session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0))
+            self._session = session
+        return self._session
+    
+    def close(self) -> None:
+        """Close the pooled HTTP session."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    
     def is_valid_svg(self, svg_content: str) -> bool:
         """Validate SVG content using lxml."""
         if not svg_content or not svg_content.strip():
             return False
+        # An <svg> root has to appear literally (possibly namespace-prefixed); rejects garbage without parsing.
+        if "<svg" not in svg_content and ":svg" not in svg_content:
+            return False
         
         if etree is None:
-            return bool(re.search(r'<svg[^>]*>', svg_content, re.IGNORECASE))
+            return bool(_SVG_OPEN_RE.search(svg_content))
         
         try:
-            sanitized = self.sanitize_svg(svg_content)
-            parser = etree.XMLParser(recover=True)
-            root = etree.fromstring(sanitized.encode(), parser=parser)
-            
-            return root.tag.endswith("svg") or root.tag == "svg"
+            tag = self._root_tag(svg_content)
+            return tag is not None and (tag.endswith("svg") or tag == "svg")
         except Exception as e:
             print(f"SVG validation failed: {e}")
             return False
     
+    def _root_tag(self, svg_content: str) -> Optional[str]:
+        """Tag of the document's root element. Sanitizing never removes the root, so only the
+        first start event is read rather than the whole document."""
+        try:
+            events = etree.iterparse(BytesIO(svg_content.encode()), events=("start",),
+                                     recover=True, resolve_entities=False)
+            for _, element in events:
+                return element.tag
+        except etree.XMLSyntaxError:
+            pass
+        root = self._parse_and_sanitize(svg_content)
+        return root.tag if root is not None else None
+    
+    def _parse_and_sanitize(self, svg_content: str):
+        """Parse once and strip dangerous elements and on* attributes from the tree; None if unparseable."""
+        parser = etree.XMLParser(recover=True, resolve_entities=False, huge_tree=False)
+        root = etree.fromstring(svg_content.encode(), parser=parser)
+        if root is None:
+            return None
+        etree.strip_elements(root, "{*}script", "{*}foreignObject", "{*}image", with_tail=False)
+        for el in root.iter():
+            for name in [a for a in el.attrib if etree.QName(a).localname.lower().startswith("on")]:
+                del el.attrib[name]
+        return root
+    
     def sanitize_svg(self, svg_content: str) -> str:
         """Remove dangerous elements from SVG."""
-        svg_content = re.sub(r'<script[^>]*>.*?</script>', '', svg_content, flags=re.DOTALL | re.IGNORECASE)
-        svg_content = re.sub(r'<foreignObject[^>]*>.*?</foreignObject>', '', svg_content, flags=re.DOTALL | re.IGNORECASE)
-        svg_content = re.sub(r'<image[^>]*>', '', svg_content, flags=re.IGNORECASE)
-        svg_content = re.sub(r'\s*on\w+\s*=\s*["\'][^"\']*["\']', '', svg_content, flags=re.IGNORECASE)
+        if etree is not None:
+            root = self._parse_and_sanitize(svg_content)
+            if root is not None:
+                return etree.tostring(root, encoding="unicode")
+        svg_content = _SCRIPT_RE.sub('', svg_content)
+        svg_content = _FOREIGN_OBJECT_RE.sub('', svg_content)
+        svg_content = _IMAGE_RE.sub('', svg_content)
+        svg_content = _EVENT_ATTR_RE.sub('', svg_content)
         return svg_content
     
     def extract_dimensions(self, svg_content: str) -> tuple[int, int]:
         """Extract width and height from SVG."""
-        width_match = re.search(r'width\s*=\s*["\']?(\d+)', svg_content, re.IGNORECASE)
-        height_match = re.search(r'height\s*=\s*["\']?(\d+)', svg_content, re.IGNORECASE)
+        return _extract_dimensions(svg_content)
+    
+    def annotate_path_lengths(self, svg_content: str) -> str:
+        """Add data-len (the path's total length) to each <path>, so pages don't measure it."""
+        if svgelements is None:
+            return svg_content
         
-        width = int(width_match.group(1)) if width_match else 400
-        height = int(height_match.group(1)) if height_match else 300
+        def add_length(match: re.Match) -> str:
+            tag = match.group(0)
+            d_match = _PATH_D_RE.search(tag)
+            if "data-len" in tag or not d_match:
+                return tag
+            try:
+                length = svgelements.Path(d_match.group(2)).length()
+            except Exception:
+                return tag
+            return f'<path data-len="{length:.1f}"{tag[len("<path"):]}'
         
-        return width, height
+        return _PATH_TAG_RE.sub(add_length, svg_content)
+
+
+@lru_cache(maxsize=1)
+def get_starvector_client() -> StarVectorClient:
+    """The process-wide client, so every caller shares its pooled connections."""
+    return StarVectorClient()
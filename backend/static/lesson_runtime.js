@@ -0,0 +1,223 @@
+// Lesson page runtime: step navigation and animations. Per-lesson values come from
+// the #lesson-data JSON block rendered into the page.
+let currentStep = 0;
+let isPlaying = false;
+let activeIdx = -1;
+let animationTimers = [];
+let strokeAnimations = [];
+const lessonData = JSON.parse(document.getElementById('lesson-data').textContent);
+const totalSteps = lessonData.total_steps;
+const els = {
+    play: document.getElementById('play-btn'),
+    pause: document.getElementById('pause-btn'),
+    progress: document.getElementById('progress-fill'),
+    steps: document.querySelectorAll('.step-container')
+};
+
+// All delayed work runs from one requestAnimationFrame loop: callbacks that come due in
+// the same frame start together, and nothing piles up while the tab is hidden.
+let scheduled = [];
+let scheduleFrame = 0;
+
+function rafSchedule(cb, delayMs) {
+    const task = { due: performance.now() + delayMs, cb: cb };
+    scheduled.push(task);
+    if (!scheduleFrame) {
+        scheduleFrame = requestAnimationFrame(runScheduled);
+    }
+    return task;
+}
+
+function runScheduled(now) {
+    scheduleFrame = 0;
+    const due = [];
+    scheduled = scheduled.filter(task => {
+        if (!task.cb) return false;
+        if (now >= task.due) {
+            due.push(task);
+            return false;
+        }
+        return true;
+    });
+    due.sort((a, b) => a.due - b.due).forEach(task => {
+        if (task.cb) task.cb();
+    });
+    if (scheduled.length && !scheduleFrame) {
+        scheduleFrame = requestAnimationFrame(runScheduled);
+    }
+}
+
+function clearTimers() {
+    animationTimers.forEach(task => { task.cb = null; });
+    animationTimers = [];
+}
+
+function showStep(stepIndex) {
+    const step = els.steps[stepIndex];
+    if (!step) return;
+
+    // Only the outgoing and incoming steps change class
+    if (activeIdx >= 0) {
+        els.steps[activeIdx].classList.remove('active');
+    }
+    if (activeIdx === stepIndex) {
+        // Reflow between remove and add so the CSS entrances restart.
+        void step.offsetWidth;
+    }
+    step.classList.add('active');
+    activeIdx = stepIndex;
+
+    // Update progress
+    const progress = ((stepIndex + 1) / totalSteps) * 100;
+    els.progress.style.width = progress + '%';
+
+    // Animate current step
+    animateStep(stepIndex);
+}
+
+function animateStep(stepIndex) {
+    const stepContainer = els.steps[stepIndex];
+    if (!stepContainer) return;
+
+    // Clear previous timers
+    clearTimers();
+    strokeAnimations.forEach(animation => animation.cancel());
+    strokeAnimations = [];
+
+    if (window.__LESSON_DEBUG) console.log('Animating step', stepIndex);
+
+    // Read phase: lengths recorded server-side as data-len; anything else is measured
+    // before any style writes so layout is forced at most once.
+    const svgs = [...stepContainer.querySelectorAll('.asset-container svg')];
+    const pathData = svgs.map(svg => [...svg.querySelectorAll('path')].map(el => ({ el: el, len: +el.dataset.len || el.getTotalLength() })));
+
+    // Write phase: one frame for all style writes. Fades run from CSS (fx-enter) and
+    // stroke drawing through the Web Animations API.
+    const timer = rafSchedule(() => {
+        if (!stepContainer.dataset.fxReady) {
+            prepareEntrances(stepContainer, svgs);
+            stepContainer.dataset.fxReady = '1';
+        }
+        pathData.forEach((paths, svgIdx) => {
+            paths.forEach(({ el, len }, pIdx) => {
+                if (len > 0) {
+                    el.style.strokeDasharray = len;
+                    el.style.strokeDashoffset = len;
+                    strokeAnimations.push(el.animate(
+                        [{ strokeDashoffset: len }, { strokeDashoffset: 0 }],
+                        {
+                            duration: 2500,
+                            delay: svgIdx * 300 + 500 + (pIdx * 150),
+                            easing: 'cubic-bezier(0.455, 0.03, 0.515, 0.955)',
+                            fill: 'forwards'
+                        }
+                    ));
+                }
+            });
+        });
+    }, 0);
+    animationTimers.push(timer);
+}
+
+function setEntrance(el, delay, duration) {
+    el.style.setProperty('--fx-delay', delay + 'ms');
+    el.style.setProperty('--fx-duration', duration + 'ms');
+    el.classList.add('fx');
+}
+
+// Tags a step's elements with their entrance timings once; afterwards the animations
+// replay whenever the step becomes .active again.
+function prepareEntrances(stepContainer, svgs) {
+    stepContainer.querySelectorAll('.key-points li').forEach((point, idx) => {
+        setEntrance(point, 500 + (idx * 200), 600);
+    });
+    const formula = stepContainer.querySelector('.formula-box');
+    if (formula) {
+        setEntrance(formula, 1000, 800);
+    }
+    svgs.forEach((svg, svgIdx) => {
+        const base = svgIdx * 300;
+        setEntrance(svg, base, 2000);
+        svg.querySelectorAll('line').forEach((el, i) => setEntrance(el, base + 800 + (i * 150), 1000));
+        svg.querySelectorAll('rect').forEach((el, i) => setEntrance(el, base + 1000 + (i * 150), 1000));
+        svg.querySelectorAll('text').forEach((el, i) => setEntrance(el, base + 1200 + (i * 100), 800));
+        svg.querySelectorAll('circle').forEach((el, i) => setEntrance(el, base + 1000 + (i * 100), 800));
+    });
+}
+
+function playAnimation() {
+    if (isPlaying) return;
+    isPlaying = true;
+    els.play.disabled = true;
+    els.pause.disabled = false;
+
+    const step = els.steps[currentStep];
+    if (step) {
+        const duration = +step.dataset.duration;
+
+        const timer = rafSchedule(() => {
+            if (currentStep < totalSteps - 1) {
+                nextStep();
+            } else {
+                pauseAnimation();
+            }
+        }, duration);
+        animationTimers.push(timer);
+    }
+}
+
+function pauseAnimation() {
+    isPlaying = false;
+    els.play.disabled = false;
+    els.pause.disabled = true;
+    clearTimers();
+}
+
+function nextStep() {
+    if (currentStep < totalSteps - 1) {
+        currentStep++;
+        showStep(currentStep);
+        if (isPlaying) {
+            playAnimation();
+        }
+    }
+}
+
+function previousStep() {
+    if (currentStep > 0) {
+        currentStep--;
+        showStep(currentStep);
+        if (isPlaying) {
+            playAnimation();
+        }
+    }
+}
+
+function restartAnimation() {
+    pauseAnimation();
+    currentStep = 0;
+    showStep(currentStep);
+}
+
+const actions = {
+    play: playAnimation,
+    pause: pauseAnimation,
+    previous: previousStep,
+    next: nextStep,
+    restart: restartAnimation
+};
+
+document.querySelector('.controls').addEventListener('click', e => {
+    const button = e.target.closest('[data-action]');
+    if (button && !button.disabled) {
+        actions[button.dataset.action]();
+    }
+});
+
+// Initialize
+showStep(0);
+
+// Auto-play on load
+rafSchedule(() => {
+    playAnimation();
+}, 1000);
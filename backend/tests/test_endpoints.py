@@ -1,11 +1,11 @@
 """
 Pytest tests for backend endpoints.
 """
+import pytest
+
 try:
-    import pytest
     from fastapi.testclient import TestClient
 except ImportError as e:
-    pytest = None  # type: ignore
     TestClient = None  # type: ignore
     print(f"Warning: Test dependencies not installed: {e}")
     print("Install with: pip install pytest fastapi")
@@ -21,23 +21,37 @@ except ImportError:
     app = None  # type: ignore
     print("Warning: Could not import app")
 
-if pytest is not None and TestClient is not None and app is not None:
-    client = TestClient(app)
-else:
-    client = None  # type: ignore
+OHM_PROMPT = "Teach me Ohm's Law with a resistor and battery"
 
 
-def test_generate_endpoint():
-    """Test /generate endpoint returns 200 and expected fields."""
-    if client is None:
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient, with the app's lifespan running, shared by every test."""
+    if TestClient is None or app is None:
         pytest.skip("TestClient not available")
-    response = client.post(
-        "/generate",
-        json={"prompt": "Teach me Ohm's Law with a resistor and battery"}
-    )
-    
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def lesson_id(client):
+    """A lesson generated once for the tests that only need one to exist."""
+    response = client.post("/generate", json={"prompt": "Test lesson"})
     assert response.status_code == 200
-    data = response.json()
+    return response.json()["lesson_id"]
+
+
+@pytest.fixture(scope="session")
+def ohm_lesson(client):
+    """The /generate response for the Ohm's Law prompt, which has resistor and battery assets."""
+    response = client.post("/generate", json={"prompt": OHM_PROMPT})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_generate_endpoint(ohm_lesson):
+    """Test /generate endpoint returns 200 (checked by the fixture) and expected fields."""
+    data = ohm_lesson
     
     assert data["status"] == "ok"
     assert "lesson_id" in data
@@ -55,17 +69,21 @@ def test_generate_endpoint():
         assert "assets" in step
 
 
-def test_get_lesson_endpoint():
-    """Test /lesson/{id} endpoint."""
-    if client is None:
-        pytest.skip("TestClient not available")
-    generate_response = client.post(
-        "/generate",
-        json={"prompt": "Test lesson"}
-    )
-    assert generate_response.status_code == 200
-    lesson_id = generate_response.json()["lesson_id"]
+def test_generate_no_steps(client, monkeypatch):
+    """Test /generate returns an empty timeline when the structure has no steps."""
+    import app as app_module
+    
+    async def no_steps(prompt):
+        return {"suggested_steps": [], "primitives": []}
     
+    monkeypatch.setattr(app_module, "extract_lesson_structure", no_steps)
+    response = client.post("/generate", json={"prompt": OHM_PROMPT})
+    assert response.status_code == 200
+    assert response.json()["lesson"]["timeline"] == []
+
+
+def test_get_lesson_endpoint(client, lesson_id):
+    """Test /lesson/{id} endpoint."""
     response = client.get(f"/lesson/{lesson_id}")
     assert response.status_code == 200
     data = response.json()
@@ -74,27 +92,245 @@ def test_get_lesson_endpoint():
     assert "timeline" in data
 
 
-def test_get_lesson_not_found():
+def test_get_lesson_not_found(client):
     """Test /lesson/{id} returns 404 for non-existent lesson."""
-    if client is None:
-        pytest.skip("TestClient not available")
     response = client.get("/lesson/nonexistent")
     assert response.status_code == 404
 
 
-def test_render_endpoint():
+def test_render_endpoint(client, lesson_id):
     """Test /render/{id} returns HTML."""
-    if client is None:
-        pytest.skip("TestClient not available")
-    generate_response = client.post(
-        "/generate",
-        json={"prompt": "Test lesson for rendering"}
-    )
-    assert generate_response.status_code == 200
-    lesson_id = generate_response.json()["lesson_id"]
-    
     response = client.get(f"/render/{lesson_id}")
     assert response.status_code == 200
     assert "text/html" in response.headers["content-type"]
     assert lesson_id in response.text
 
+
+def test_render_etag_not_modified(client, lesson_id):
+    """Test /render/{id} returns 304 when the ETag still matches."""
+    response = client.get(f"/render/{lesson_id}")
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    
+    response = client.get(f"/render/{lesson_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_render_streamed_then_cached(client, lesson_id, monkeypatch):
+    """Test a cache miss streams the full page, and the next request is served from the cache."""
+    from collections import OrderedDict
+    import orjson
+    import app as app_module
+    
+    cache = OrderedDict()
+    monkeypatch.setattr(app_module, "RENDER_CACHE", cache)
+    lesson = orjson.loads((app_module.DATA_DIR / f"lesson_{lesson_id}.json").read_bytes())
+    expected = app_module.generate_rendered_html(lesson, "http://testserver", inline_runtime=False)
+    
+    streamed = client.get(f"/render/{lesson_id}")
+    assert streamed.status_code == 200
+    assert streamed.text == expected
+    assert [key[0] for key in cache] == [lesson_id]
+    
+    cached = client.get(f"/render/{lesson_id}")
+    assert cached.content == streamed.content
+    assert cached.headers["etag"] == streamed.headers["etag"]
+    assert len(cache) == 1
+
+
+def test_render_cache_invalidated_by_lesson_edit(client, lesson_id):
+    """Test editing the lesson file (a new mtime) re-renders the page under a new ETag."""
+    import os
+    import app as app_module
+    
+    etag = client.get(f"/render/{lesson_id}").headers["etag"]
+    
+    lesson_file = app_module.DATA_DIR / f"lesson_{lesson_id}.json"
+    stat = lesson_file.stat()
+    os.utime(lesson_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    
+    response = client.get(f"/render/{lesson_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert lesson_id in response.text
+
+
+def test_render_embed_etag(client, lesson_id):
+    """Test the embed fragment has its own ETag and answers If-None-Match with 304."""
+    page_etag = client.get(f"/render/{lesson_id}").headers["etag"]
+    
+    response = client.get(f"/render/{lesson_id}/embed")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag != page_etag
+    
+    response = client.get(f"/render/{lesson_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    
+    response = client.get(f"/render/{lesson_id}/embed", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_asset_etag_not_modified(client, ohm_lesson):
+    """Test /assets/{name} returns 304 when the ETag still matches."""
+    asset_url = ohm_lesson["lesson"]["timeline"][0]["assets"][0]["url"]
+    
+    response = client.get(asset_url)
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    
+    response = client.get(asset_url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+def test_asset_gzip(client, ohm_lesson):
+    """Test /assets/{name} serves a gzipped body that decodes to the plain SVG."""
+    asset_url = ohm_lesson["lesson"]["timeline"][0]["assets"][0]["url"]
+    
+    plain = client.get(asset_url, headers={"Accept-Encoding": "identity"})
+    assert plain.status_code == 200
+    assert "content-encoding" not in plain.headers
+    
+    response = client.get(asset_url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("image/svg+xml")
+    assert response.content == plain.content
+
+
+def test_generate_invalid_body(client):
+    """Test /generate rejects a body without a prompt with 422."""
+    response = client.post("/generate", json={"topic": "No prompt"})
+    assert response.status_code == 422
+
+
+def test_list_sessions_order_and_limit(client):
+    """Test /sessions lists the most recently updated sessions first and honours limit."""
+    session_ids = []
+    for topic in ("first", "second", "third"):
+        response = client.post("/sessions", json={"topic": topic})
+        assert response.status_code == 200
+        session_ids.append(response.json()["session_id"])
+    
+    response = client.put(f"/sessions/{session_ids[0]}", json={"topic": "first, updated"})
+    assert response.status_code == 200
+    
+    sessions = client.get("/sessions").json()["sessions"]
+    listed = [s["session_id"] for s in sessions if s["session_id"] in session_ids]
+    assert listed == [session_ids[0], session_ids[2], session_ids[1]]
+    assert sessions[0]["topic"] == "first, updated"
+    assert "messages" not in sessions[0]
+    
+    updated = [s["updated_at"] for s in sessions]
+    assert updated == sorted(updated, reverse=True)
+    
+    limited = client.get("/sessions", params={"limit": 2}).json()["sessions"]
+    assert [s["session_id"] for s in limited] == [session_ids[0], session_ids[2]]
+
+
+def test_session_index_reconciled(client):
+    """Test the sessions index picks up session files written outside the API and drops deleted ones."""
+    import orjson
+    import app as app_module
+    
+    response = client.post("/sessions", json={"topic": "Deleted"})
+    deleted_id = response.json()["session_id"]
+    (app_module.SESSIONS_DIR / f"session_{deleted_id}.json").unlink()
+    
+    external = {
+        "session_id": "external",
+        "topic": "Written by hand",
+        "created_at": "2000-01-01T00:00:00.000000",
+        "updated_at": "2000-01-01T00:00:00.000000"
+    }
+    external_file = app_module.SESSIONS_DIR / "session_external.json"
+    external_file.write_bytes(orjson.dumps(external))
+    try:
+        app_module._reconcile_session_index()
+        
+        listed = {s["session_id"]: s for s in client.get("/sessions").json()["sessions"]}
+        assert deleted_id not in listed
+        assert listed["external"]["topic"] == "Written by hand"
+    finally:
+        external_file.unlink()
+        app_module._reconcile_session_index()
+
+
+def test_render_unindexed_session(client, lesson_id):
+    """Test session render routes fall back to the session file when the index has no row for it."""
+    import orjson
+    import app as app_module
+    
+    session = {
+        "session_id": "unindexed",
+        "topic": "Not in the index",
+        "lesson_id": lesson_id,
+        "created_at": "2000-01-01T00:00:00.000000",
+        "updated_at": "2000-01-01T00:00:00.000000"
+    }
+    session_file = app_module.SESSIONS_DIR / "session_unindexed.json"
+    session_file.write_bytes(orjson.dumps(session))
+    try:
+        assert client.get("/sessions/unindexed").status_code == 200
+        
+        response = client.get("/sessions/unindexed/render/embed")
+        assert response.status_code == 200
+        assert response.content == client.get(f"/render/{lesson_id}/embed").content
+        
+        listed = [s["session_id"] for s in client.get("/sessions").json()["sessions"]]
+        assert "unindexed" in listed
+    finally:
+        session_file.unlink()
+        app_module._reconcile_session_index()
+
+
+@pytest.mark.parametrize("user_version", [0, 1])
+def test_primitive_rows_upgraded(tmp_path, monkeypatch, user_version):
+    """Test old primitives rows (JSON blobs at v0, sha256 keys before v2) are found under the current keys."""
+    if app is None:
+        pytest.skip("app not available")
+    import hashlib
+    import json
+    import sqlite3
+    import app as app_module
+    
+    params = {"resistance": 100, "label": "R1"}
+    render_meta = {"width": 200}
+    legacy_key = hashlib.sha256(
+        f"resistor:{json.dumps(params, sort_keys=True)}:v1".encode()
+    ).hexdigest()
+    if user_version == 0:
+        blobs = (json.dumps(params).encode(), json.dumps(render_meta).encode())
+    else:
+        blobs = (app_module.msgpack_encoder.encode(params), app_module.msgpack_encoder.encode(render_meta))
+    
+    old_db = sqlite3.connect(tmp_path / "kydy.db", isolation_level=None, check_same_thread=False)
+    old_db.execute(
+        "CREATE TABLE primitives (cache_key TEXT PRIMARY KEY, asset_id TEXT, asset_file TEXT,"
+        " primitive_id TEXT, params BLOB, render_meta BLOB)"
+    )
+    old_db.execute(
+        "INSERT INTO primitives VALUES (?, ?, ?, ?, ?, ?)",
+        (legacy_key, "abc", "resistor_abc.svg", "resistor") + blobs
+    )
+    old_db.execute(f"PRAGMA user_version = {user_version}")
+    monkeypatch.setattr(app_module, "db", old_db)
+    monkeypatch.setattr(app_module, "PRIMITIVES_CACHE", {})
+    
+    app_module._upgrade_primitive_rows()
+    
+    assert old_db.execute("PRAGMA user_version").fetchone()[0] == 2
+    cached = app_module._load_cached_primitive(app_module.compute_cache_key("resistor", params))
+    assert cached == {
+        "asset_id": "abc",
+        "asset_file": "resistor_abc.svg",
+        "primitive_id": "resistor",
+        "params": params,
+        "render_meta": render_meta
+    }
+    assert app_module._load_cached_primitive(legacy_key) is None
+    old_db.close()
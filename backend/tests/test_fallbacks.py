@@ -0,0 +1,54 @@
+"""
+Pytest tests for the parametric SVG fallback cache.
+"""
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import fallbacks
+from fallbacks import ParametricSVGGenerator, _freeze
+
+
+@pytest.fixture
+def svg_cache(monkeypatch):
+    """An empty SVG cache holding at most two entries."""
+    cache = OrderedDict()
+    monkeypatch.setattr(fallbacks, "_SVG_CACHE", cache)
+    monkeypatch.setattr(fallbacks, "_SVG_CACHE_SIZE", 2)
+    return cache
+
+
+def test_freeze_keeps_value_types():
+    """Test params that compare equal but differ in type freeze to different keys."""
+    assert _freeze({"value": 1}) != _freeze({"value": "1"})
+    assert _freeze({"value": 1}) != _freeze({"value": True})
+    assert _freeze({"a": 1, "b": [2, 3]}) == _freeze({"b": [2, 3], "a": 1})
+
+
+def test_svg_cache_keyed_on_value_type(svg_cache):
+    """Test {"value": 1} and {"value": "1"} get separate cache entries."""
+    generator = ParametricSVGGenerator()
+    generator.generate_with_digest("resistor", {"value": 1})
+    generator.generate_with_digest("resistor", {"value": "1"})
+    assert list(svg_cache) == [
+        ("resistor", _freeze({"value": 1})),
+        ("resistor", _freeze({"value": "1"}))
+    ]
+
+
+def test_svg_cache_evicts_least_recently_used(svg_cache):
+    """Test a full cache evicts the entry used longest ago, counting hits as uses."""
+    generator = ParametricSVGGenerator()
+    first = generator.generate_with_digest("resistor", {"value": "1k"})
+    generator.generate_with_digest("resistor", {"value": "2k"})
+    assert generator.generate_with_digest("resistor", {"value": "1k"}) == first
+    
+    generator.generate_with_digest("resistor", {"value": "3k"})
+    assert list(svg_cache) == [
+        ("resistor", _freeze({"value": "1k"})),
+        ("resistor", _freeze({"value": "3k"}))
+    ]
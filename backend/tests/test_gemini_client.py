@@ -0,0 +1,76 @@
+"""
+Pytest tests for the Gemini client's response parsing.
+"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from gemini_client import _extract_json_block
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', '{"a": 1}'),
+    ('{"a": "}{"} trailing', '{"a": "}{"}'),
+    ('{"a": "say \\"}\\" loudly", "b": 2}', '{"a": "say \\"}\\" loudly", "b": 2}'),
+    ('{"a": "ends in a backslash \\\\"}', '{"a": "ends in a backslash \\\\"}'),
+    ('Here is the lesson:\n{"a": 1}\nHope that helps!', '{"a": 1}'),
+    ('```json\n{"a": 1}\n```', '{"a": 1}'),
+    ('{"a": {"b": {"c": [1, {"d": 2}]}}, "e": 3} {"f": 4}', '{"a": {"b": {"c": [1, {"d": 2}]}}, "e": 3}'),
+])
+def test_extract_json_block(text, expected):
+    """Test the first balanced object is returned, ignoring braces and escaped quotes inside strings."""
+    block = _extract_json_block(text)
+    assert block == expected
+    json.loads(block)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "no json here",
+    '{"a": 1',
+    '{"a": {"b": 1}',
+    '{"a": "}"',
+])
+def test_extract_json_block_unbalanced(text):
+    """Test None is returned when there's no object or it never closes."""
+    assert _extract_json_block(text) is None
+
+
+def _client(monkeypatch, response):
+    """A GeminiClient with a key whose calls answer with response, or raise it if it's an exception."""
+    from gemini_client import GeminiClient
+    
+    def call(full_prompt):
+        assert full_prompt.endswith("User prompt: Ohm's law\n\nJSON:")
+        if isinstance(response, Exception):
+            raise response
+        return response
+    
+    async def call_async(full_prompt):
+        return call(full_prompt)
+    
+    client = GeminiClient()
+    client.api_key = "test-key"
+    monkeypatch.setattr(client, "_call_gemini", call)
+    monkeypatch.setattr(client, "_call_gemini_async", call_async)
+    return client
+
+
+@pytest.mark.parametrize("response, expected_topic", [
+    ('```json\n{"topic": "From Gemini"}\n```', "From Gemini"),
+    (ConnectionError("unreachable"), "Ohm's law"),
+    ("not json", "Ohm's law"),
+])
+def test_extract_lesson_structure(monkeypatch, response, expected_topic):
+    """Test the sync and async extractions parse Gemini's answer, or fall back to keywords when it fails."""
+    import asyncio
+    
+    client = _client(monkeypatch, response)
+    sync_result = client.extract_lesson_structure("Ohm's law")
+    async_result = asyncio.run(client.extract_lesson_structure_async("Ohm's law"))
+    assert sync_result == async_result
+    assert sync_result["topic"] == expected_topic
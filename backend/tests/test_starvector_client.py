@@ -0,0 +1,71 @@
+"""
+Pytest tests for the StarVector client's response handling.
+"""
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from starvector_client import _MAX_RETRY_DELAY, _SVGStreamScanner, _retry_delay
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><rect width="10" height="10"/></svg>'
+
+
+def _feed_all(chunks):
+    """Feed chunks in order, returning each feed's result."""
+    scanner = _SVGStreamScanner()
+    return [scanner.feed(chunk) for chunk in chunks]
+
+
+@pytest.mark.parametrize("split", [len(SVG) - 4, len(SVG) - 3, len(SVG) - 1])
+def test_scanner_close_tag_split_in_two(split):
+    """Test a closing tag split across two chunks is found once its last byte arrives."""
+    assert _feed_all([SVG[:split], SVG[split:]]) == [None, SVG.decode()]
+
+
+def test_scanner_close_tag_split_in_three():
+    """Test a closing tag split across three chunks is found on the third."""
+    split = len(SVG) - len(b"</svg>")
+    chunks = [SVG[:split + 2], SVG[split + 2:split + 4], SVG[split + 4:]]
+    assert _feed_all(chunks) == [None, None, SVG.decode()]
+
+
+def test_scanner_prose_before_svg():
+    """Test text ahead of the SVG is dropped."""
+    chunks = [b"Here is your image:\n", SVG[:20], SVG[20:] + b"\nEnjoy!"]
+    assert _feed_all(chunks) == [None, None, SVG.decode()]
+
+
+def test_scanner_no_svg_opener():
+    """Test a body with a closing tag but no <svg> opener yields nothing."""
+    assert _feed_all([b"<p>not an image", b"</p></svg>", b" more text"]) == [None, None, None]
+
+
+class FakeHTTPError(Exception):
+    """Stands in for requests' HTTPError, which carries the failed response."""
+    
+    def __init__(self, status_code, headers=None):
+        super().__init__(status_code)
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def test_retry_delay_client_error():
+    """Test a 4xx other than 429 isn't retried."""
+    assert _retry_delay(FakeHTTPError(400), 0) is None
+
+
+def test_retry_delay_retry_after():
+    """Test a numeric Retry-After is honoured, up to _MAX_RETRY_DELAY."""
+    assert _retry_delay(FakeHTTPError(429, {"Retry-After": "3"}), 0) == 3
+    assert _retry_delay(FakeHTTPError(429, {"Retry-After": "3600"}), 0) == _MAX_RETRY_DELAY
+
+
+@pytest.mark.parametrize("attempt", [0, 1, 2, 3])
+def test_retry_delay_backoff(attempt):
+    """Test errors without a response back off exponentially with up to 50% jitter."""
+    for _ in range(50):
+        delay = _retry_delay(ConnectionError("refused"), attempt)
+        assert 2 ** attempt <= delay <= 1.5 * 2 ** attempt